@@ -1,50 +1,218 @@
+import os
 import socket
-import json
-from TypeEnforcement.type_enforcer import TypeEnforcer
+import struct
 import typing
-import pydantic
+from types import SimpleNamespace
 try:
-    from . import schemas
+    from . import serializers
+    from . import helpers
+    from . import exceptions
 except:
-    import schemas
+    import serializers
+    import helpers
+    import exceptions
 
+schemas = helpers.lazy_import('schemas', __package__) # pydantic is only loaded by whoever builds models
 
-schema_types: dict = {
-        'CommandData':schemas.CommandData,
-        'AuthData':schemas.AuthData,
-        'StartupData':schemas.StartupData,
-        'ResponseData':schemas.ResponseData,
-        'FormRequest':schemas.FormRequest,
-        'FormResponse':schemas.FormResponse,
-        'AuthRequest':schemas.AuthRequest,
-        'ConfirmationRequest':schemas.ConfirmationRequest
-    }
+
+schema_types: tuple = (
+        'CommandData',
+        'AuthData',
+        'StartupData',
+        'ResponseData',
+        'FormRequest',
+        'FormResponse',
+        'AuthRequest',
+        'ConfirmationRequest',
+        'StreamData',
+        'CancelData'
+    )
+
+# every message on the wire is a fixed size header followed by the payload. The header holds the payload length,
+# the codec the payload was encoded with and a schema type code, so the receiver knows exactly how many bytes to read,
+# how to decode them and what model to build
+HEADER = struct.Struct('!IBB') # unsigned 32 bit payload length, unsigned 8 bit codec id, unsigned 8 bit schema code
+UNTYPED = 0 # schema code for plain payloads that are not one of the schemas
+MAX_FRAME_SIZE = 256 * 2**20 # largest payload accepted. Anything bigger is a stray client or raw json, not a frame
+schema_codes: dict = {schema_name:code for code, schema_name in enumerate(schema_types, start=1)} # order is the wire format
+schema_names: dict = {code:schema_name for schema_name, code in schema_codes.items()}
+
+
+# the cli and server share a host, where a unix socket skips the tcp stack and is guarded by file permissions. TCP is
+# there for platforms without unix sockets and only ever listens on loopback: a new CLI adopts the server's warm login
+# without a password, so the server must not be reachable from other machines. TAPIS_CLI_TRANSPORT picks one, unix
+# where supported
+TRANSPORTS = ('unix', 'tcp') if hasattr(socket, 'AF_UNIX') else ('tcp',)
+
+
+def transport() -> str:
+    choice = os.environ.get('TAPIS_CLI_TRANSPORT', TRANSPORTS[0]).lower()
+    if choice not in TRANSPORTS:
+        raise ValueError(f"Unsupported transport {choice}, use one of {', '.join(TRANSPORTS)}")
+    return choice
+
+
+def unix_path(port: int) -> str:
+    """
+    the socket file standing in for the port. It lives in the owner only app directory
+    """
+    return os.path.join(helpers.app_path('server'), f'server-{port}.sock')
+
+
+def connect(ip: str, port: int, transport: str) -> socket.socket:
+    if transport == 'unix':
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address = unix_path(port)
+    else:
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # headers and payloads go out in one send anyway
+        address = (ip, port)
+    try:
+        connection.connect(address)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def listen(ip: str, port: int, transport: str) -> socket.socket:
+    if transport == 'tcp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((ip, port))
+    else:
+        path = unix_path(port)
+        try:
+            connect(ip, port, transport).close()
+            raise OSError(f"A server is already listening on {path}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        if os.path.exists(path): # left behind by a server that did not shut down cleanly
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177) # the socket file is created owner read/write only, with no window where others can connect
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(umask)
+    sock.listen(socket.SOMAXCONN) # any number of CLIs can queue up to connect
+    return sock
+
+
+def message(schema_type: str, **fields) -> dict:
+    """
+    a schema as the dict it travels as, for senders that skip building the model. The receiver still validates it
+    """
+    return dict(fields, schema_type=schema_type)
 
 
 class SocketOpts:
+    codec = serializers.JSONCodec # encoding used for outgoing messages. Switched after the StartupData handshake
+    models = True # received messages become schema models. Without, they are plain attribute namespaces
+
+    def receive_exactly(self, connection, size: int) -> bytearray:
+        buffer = bytearray(size) # preallocate the full message, then fill it in place
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = connection.recv_into(view[received:], size - received)
+            if not count: # the other side closed the connection in the middle of a message
+                raise ConnectionError("[-] Connection was dropped")
+            received += count
+        return buffer
+
+    def frame_receive_explicit(self, connection) -> tuple[int, typing.Any]:
+        length, codec_id, schema_code = HEADER.unpack(self.receive_exactly(connection, HEADER.size))
+        # checked before anything is allocated, so garbage on the socket cannot make the receiver reserve gigabytes
+        if length > MAX_FRAME_SIZE:
+            raise exceptions.ProtocolError(f"Frame of {length} bytes is over the {MAX_FRAME_SIZE} byte limit")
+        if codec_id not in serializers.codecs_by_id:
+            raise exceptions.ProtocolError(f"Frame uses unknown codec {codec_id}")
+        if schema_code != UNTYPED and schema_code not in schema_names:
+            raise exceptions.ProtocolError(f"Frame has unknown schema code {schema_code}")
+        payload = self.receive_exactly(connection, length)
+        return schema_code, serializers.codecs_by_id[codec_id].decode(payload) # frames say how they were encoded
+
+    def frame_send_explicit(self, connection, payload: bytes, schema_code: int=UNTYPED):
+        header = HEADER.pack(len(payload), self.codec.codec_id, schema_code)
+        connection.sendall(header + payload) # sendall loops until every byte is out
+
     def json_receive_explicit(self, connection):
-        json_data = ""
-        while True:
-            try: #to handle long files, so that it continues to receive data and create a complete file
-                json_data = json_data + connection.recv(1024).decode('utf-8') #formulate a full file. Combine sequential data streams to unpack
-                return json.loads(json_data) #this is necessary whenever transporting any large amount of data over TCP streams
-            except ValueError:
-                continue
-    
+        schema_code, data = self.frame_receive_explicit(connection)
+        return data
+
     def json_send_explicit(self, connection, data):
-        json_data = json.dumps(data)
-        connection.send(json_data.encode())
+        schema_code = UNTYPED
+        if isinstance(data, dict):
+            schema_code = schema_codes.get(data.get('schema_type'), UNTYPED)
+        self.frame_send_explicit(connection, self.codec.encode(data), schema_code)
 
     def schema_unpack_explicit(self, connection):
-        data = self.json_receive_explicit(connection)
-        schema_type = schema_types[data['schema_type']]
-        return schema_type(**data)
+        schema_code, data = self.frame_receive_explicit(connection)
+        if not self.models:
+            return SimpleNamespace(**data)
+        return getattr(schemas, schema_names.get(schema_code) or data['schema_type'])(**data)
 
-    def json_receive(self) -> str | list | dict: # Receive and unpack json 
+    def json_receive(self) -> str | list | dict: # Receive and unpack json
         return self.json_receive_explicit(self.connection)
-    
+
     def json_send(self, data: dict | list | str): # package data in json and send
         return self.json_send_explicit(self.connection, data)
 
     def schema_unpack(self):
-        return self.schema_unpack_explicit(self.connection)
\ No newline at end of file
+        return self.schema_unpack_explicit(self.connection)
+
+
+if __name__ == "__main__":
+    # transport benchmark. Over a real listening socket for each transport, times small CommandData/ResponseData
+    # round trips, then the throughput of ResponseData messages of growing size. With framed reads the time per MB
+    # should stay flat as the message size grows
+    import sys
+    import threading
+    import time
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 30999
+    opts = SocketOpts()
+    command = schemas.CommandData(kwargs={'command_group':'pods', 'command':'get_pods'}, request_id=1).dict()
+    reply = schemas.ResponseData(response_message=[{'pod_id':'pod', 'status':'ON'}], request_id=1).dict()
+    for name in TRANSPORTS:
+        server_socket = listen('127.0.0.1', port, name)
+        client = connect('127.0.0.1', port, name)
+        peer, _ = server_socket.accept()
+
+        round_trips = 2000
+        def echo():
+            for _ in range(round_trips):
+                opts.schema_unpack_explicit(peer)
+                opts.json_send_explicit(peer, reply)
+        echo_thread = threading.Thread(target=echo)
+        echo_thread.start()
+        start = time.perf_counter()
+        for _ in range(round_trips):
+            opts.json_send_explicit(client, command)
+            opts.schema_unpack_explicit(client)
+        elapsed = time.perf_counter() - start
+        echo_thread.join()
+        print(f"{name}: {elapsed / round_trips * 1e6:8.1f} us per round trip")
+
+        repeats = 5
+        for size in (2**16, 2**18, 2**20, 2**22, 2**24):
+            message_data = schemas.ResponseData(response_message='x' * size).dict()
+
+            def send_all():
+                for _ in range(repeats):
+                    opts.json_send_explicit(client, message_data)
+
+            send_thread = threading.Thread(target=send_all)
+            start = time.perf_counter()
+            send_thread.start()
+            for _ in range(repeats):
+                opts.schema_unpack_explicit(peer)
+            send_thread.join()
+            elapsed = time.perf_counter() - start
+            megabytes = size * repeats / 2**20
+            print(f"{name}: {size:>10} bytes: {megabytes / elapsed:8.1f} MB/s, {elapsed / megabytes * 1000:6.2f} ms/MB")
+        for sock in (client, peer, server_socket):
+            sock.close()
+        if name == 'unix':
+            os.remove(unix_path(port))
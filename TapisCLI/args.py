@@ -45,4 +45,52 @@ class Args:
             "args":["-v", "--verbose"],
             "kwargs":{"action":"store_true"}
         },
+        "resume":{
+            "args":["-R", "--resume"],
+            "kwargs":{"action":"store_true"}
+        },
+        "direction":{
+            "args":["-D", "--direction"],
+            "kwargs":{"action":"store", "choices":["push", "pull"]}
+        },
+        "size":{
+            "args":["-S", "--size"],
+            "kwargs":{"action":"store"}
+        },
+        "age":{
+            "args":["-A", "--age"],
+            "kwargs":{"action":"store"}
+        },
+        "fresh":{
+            "args":["-f", "--fresh"],
+            "kwargs":{"action":"store_true"}
+        },
+        "expression":{
+            "args":["-e", "--expression"],
+            "kwargs":{"action":"store"}
+        },
+        "output":{
+            "args":["-o", "--output"],
+            "kwargs":{"action":"store"}
+        },
+        "batch_size":{
+            "args":["-B", "--batch_size"],
+            "kwargs":{"action":"store", "type":int}
+        },
+        "parallel":{
+            "args":["-P", "--parallel"],
+            "kwargs":{"action":"store", "type":int}
+        },
+        "params":{
+            "args":["-p", "--params"],
+            "kwargs":{"action":"store"}
+        },
+        "archive":{
+            "args":["-a", "--archive"],
+            "kwargs":{"action":"store_true"}
+        },
+        "rate":{
+            "args":["-r", "--rate"],
+            "kwargs":{"action":"store", "type":float}
+        },
     }
\ No newline at end of file
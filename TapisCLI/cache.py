@@ -0,0 +1,71 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    size bounded LRU cache whose entries also expire after their own ttl. Entries carry tags so that
+    everything tied to a resource can be dropped at once when that resource changes
+    """
+    def __init__(self, max_entries: int=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires at, value, tags), least recently used first
+        self.tags = dict()  # tag -> keys carrying it
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key) -> tuple[bool, object]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self.__remove(key)
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value, ttl: float, tags: tuple=()):
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+            self.entries[key] = (time.monotonic() + ttl, value, tags)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self.__remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, tag) -> int:
+        with self.lock:
+            keys = self.tags.pop(tag, set())
+            for key in keys:
+                self.__remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries':len(self.entries), 'hits':self.hits, 'misses':self.misses,
+                    'hit_rate':round(self.hits / lookups, 3) if lookups else None,
+                    'evictions':self.evictions, 'invalidations':self.invalidations}
+
+    def __remove(self, key):
+        expires, value, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
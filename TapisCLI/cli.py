@@ -1,39 +1,48 @@
 #!/usr/bin/python3
 
 import socket
+import shlex
 import argparse
 from argparse import SUPPRESS
 import sys
-import json
-import pyfiglet
 from getpass import getpass
-import threading
 import os
 import time
-from pprint import pprint
-from TypeEnforcement.type_enforcer import TypeEnforcer
 import typing
-import subprocess
+import signal
+import select
+import threading
+import itertools
+import contextlib
 
+# the client is kept thin so one shot commands start fast. It sends plain dicts and reads replies as attribute
+# namespaces, leaving pydantic validation to the server, and pyfiglet and pprint are only loaded when used
 try:
-    from . import schemas
     from . import SocketOpts as SO
     from . import helpers
     from . import decorators
     from . import args
+    from . import serializers
+    from . import daemon
 except:
-    import schemas
     import SocketOpts as SO
     import helpers
     import decorators
     import args
+    import serializers
+    import daemon
 
 
 class CLI(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup):
-    @TypeEnforcer.enforcer(recursive=True)
-    def __init__(self, IP: str, PORT: int):
+    models = False
+
+    def __init__(self, IP: str, PORT: int, transport: str | None=None):
         self.ip, self.port = IP, PORT
-        self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM) 
+        self.transport = transport or SO.transport()
+        self.request_ids = itertools.count(1) # every command gets its own id so responses can arrive in any order
+        self.in_flight = set() # request ids still waiting on their response, the ones Ctrl-C cancels
+        self.cancel_sent = False
+        self.max_in_flight = None # how many commands the server runs at once for this CLI, learned in the handshake
 
         # sets up connection with the server
         self.username, self.url = self.connect()
@@ -45,45 +54,35 @@ class CLI(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup):
         for parameters in args.Args.argparser_args.values():
             self.parser.add_argument(*parameters["args"], **parameters["kwargs"])
 
-    def initialize_server(self): 
+    @decorators.AnimatedLoading
+    def start_server(self) -> tuple[socket.socket, dict | None]:
         """
-        detect client operating system. The local server intitialization is different between unix and windows based systems
+        launch the server in the background and wait for it to report that it is ready
         """
-        if 'win' in sys.platform:
-            os.system(r"pythonw .\server.py")
-        else: # unix based
-            os.system(r"python .\server.py &")
+        return daemon.wait_ready(daemon.launch(self.port, self.transport), self.ip, self.port, self.transport)
 
-    @decorators.AnimatedLoading
-    def connection_initialization(self): # patience. This sometimes takes a while
+    def connection_initialization(self):
         """
-        start the local server through the client
+        connect to the local server, starting it first if nothing is listening
         """
-        startup_flag = False # flag to tell code not to run multiple server setup threads at once
-        timeout_time = time.time() + 30 # server setup timeout. If expires, there is a problem!
-        while True:
-            if time.time() > timeout_time: # connection timeout condition
-                sys.stdout.write("\r[-] Connection timeout")
-                os._exit(0)
-            try:
-                self.connection.connect((self.ip, self.port)) # try to establish a connection
-                if startup_flag:
-                    startup.kill()
-                break
-            except Exception as e:
-                if not startup_flag:
-                    startup = helpers.KillableThread(target=self.initialize_server) # run the server setup on a separate thread
-                    startup.start() 
-                    startup_flag = True # set the flag to true so the thread runs only once
-                    continue
+        self.connection = daemon.try_connect(self.ip, self.port, self.transport) # a running server answers at once
+        if self.connection:
+            return
+        start = time.perf_counter()
+        try:
+            self.connection, _ = self.start_server()
+        except (ConnectionError, TimeoutError) as e:
+            sys.stdout.write(f"\r[-] {e}\n")
+            os._exit(1)
+        sys.stdout.write(f"\r[+] Started the server in {time.perf_counter() - start:.2f}s\n")
 
     def connect(self):
         """
         connect to the local server
         """
         self.connection_initialization() # connect to the server
-        #self.connection.connect((self.ip, self.port)) # enable me for debugging. Requires manual server start
-        connection_info: schemas.StartupData = self.schema_unpack() # receive info from the server whether it is a first time connection
+        connection_info = self.schema_unpack() # receive info from the server whether it is a first time connection
+        self.codec = serializers.negotiate(connection_info.codecs) # best codec both sides support. Used once the server receives the choice
         if connection_info.initial: # if the server is receiving its first connection for the session\
             while True:
                 try:
@@ -91,39 +90,64 @@ class CLI(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup):
                 except KeyboardInterrupt:
                     url = " "
                     pass
-                url_data = schemas.StartupData(url=url)
-                self.json_send(url_data.dict())
-                auth_request: schemas.AuthRequest = self.schema_unpack()
+                url_data = SO.message('StartupData', url=url, codec=self.codec.name)
+                self.json_send(url_data)
+                auth_request = self.schema_unpack()
                 try:
                     username = str(input("\nUsername: ")) # take the username
                     password = getpass("Password: ") # take the password
                 except KeyboardInterrupt:
                     username, password = " ", " "
                     pass
-                auth_data = schemas.AuthData(username = username, password = password)
-                self.json_send(auth_data.dict()) # send the username and password to the server to be used
+                auth_data = SO.message('AuthData', username = username, password = password)
+                self.json_send(auth_data) # send the username and password to the server to be used
 
-                verification: schemas.ResponseData | schemas.StartupData = self.schema_unpack() # server responds saying if the verification succeeded or not
+                verification = self.schema_unpack() # server responds saying if the verification succeeded or not
                 if verification.schema_type == 'StartupData': # verification success, program moves forward
+                    self.max_in_flight = getattr(verification, 'max_in_flight', None)
                     return verification.username, verification.url
                 else: # verification failed. User has 3 tries, afterwards the program will shut down
                     print(f"[-] verification failure, attempt # {verification.response_message[1]}")
                     if verification.response_message[1] == 3:
                         sys.exit(0)
                     continue
-
+        codec_data = SO.message('StartupData', codec=self.codec.name)
+        self.json_send(codec_data)
+        connection_info = self.schema_unpack()
+        self.max_in_flight = getattr(connection_info, 'max_in_flight', None)
         print(f"[+] Connected to the Tapis service at {connection_info.url}")
         return connection_info.username, connection_info.url # return the username and url
 
-    @TypeEnforcer.enforcer(recursive=True)
     def process_command(self, command: str) -> list[str]: 
         """
-        split the command string into a list. Not sure why this was even made
+        split the command string into a list the way a shell would, so quoting works and runs of spaces do not
+        become empty arguments
         """
-        command = command.split(' ') 
-        return command
+        return shlex.split(command)
+
+    def prompt(self, text: str) -> str:
+        """
+        input() that also prints what the server pushes while the user sits at the prompt, like a watched job
+        changing state. Where stdin cannot be selected on (windows, piped input) those wait for the next response
+        """
+        if os.name == 'nt' or not sys.stdin.isatty():
+            return input(text)
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        while True:
+            readable, _, _ = select.select([sys.stdin, self.connection], [], [])
+            if sys.stdin in readable: # the terminal hands over whole lines, so this never splits what is being typed
+                line = sys.stdin.readline()
+                if not line:
+                    raise EOFError
+                return line.rstrip('\n')
+            message = self.schema_unpack() # nothing is in flight, so this is a notification
+            if message.schema_type == 'StreamData':
+                sys.stdout.write("\n")
+                self.print_response(message.message)
+                sys.stdout.write(text)
+                sys.stdout.flush()
 
-    @TypeEnforcer.enforcer(recursive=True)
     def expression_input(self) -> str: # for subclients. Pods and apps running through Tapis will have their own inputs. This gives user an interface
         print("Enter 'exit' to submit") # user must enter exit to submit their input
         expression = ''
@@ -133,7 +157,6 @@ class CLI(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup):
             expression += line
         return expression
 
-    @TypeEnforcer.enforcer(recursive=True)
     def fillout_form(self, form: list) -> dict:
         filled_form = dict()
         for field in form:
@@ -141,50 +164,151 @@ class CLI(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup):
             filled_form.update({field:value})
         return filled_form
 
-    @TypeEnforcer.enforcer(recursive=True)
     def command_operator(self, kwargs: dict | list, exit_: int=0): # parses command input
         if isinstance(kwargs, list): # check if the command input is from the CLI, or direct input
             kwargs = vars(self.parser.parse_args(kwargs)) # parse the arguments
         if not kwargs['command_group']:
             return False
-        command = schemas.CommandData(kwargs = kwargs, exit_status = exit_)
+        command = SO.message('CommandData', kwargs = kwargs, exit_status = exit_, cwd = os.getcwd()) # the server is shared, local paths are relative to this shell
         return command
+
+    def send_command(self, command: dict) -> int:
+        command['request_id'] = next(self.request_ids)
+        if not self.in_flight:
+            self.cancel_sent = False
+        self.in_flight.add(command['request_id'])
+        self.json_send(command)
+        return command['request_id']
+
+    @contextlib.contextmanager
+    def interrupts_cancel(self):
+        """
+        while waiting on the server, Ctrl-C asks it to cancel the commands in flight instead of breaking off in the
+        middle of a message. The interrupted read simply carries on and picks up the cancelled responses. A second
+        Ctrl-C stops waiting and quits
+        """
+        if threading.current_thread() is not threading.main_thread(): # only the main thread receives signals
+            yield
+            return
+
+        def cancel(signum, frame):
+            if self.cancel_sent:
+                sys.stdout.write("\n[-] Stopped waiting on the server\n")
+                os._exit(1)
+            self.cancel_sent = True
+            sys.stdout.write("\n[*] Cancelling, press Ctrl-C again to stop waiting\n")
+            for request_id in self.in_flight:
+                self.json_send(SO.message('CancelData', request_id=request_id))
+
+        previous = signal.signal(signal.SIGINT, cancel)
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGINT, previous)
+
+    def pipeline(self, commands: list[list[str] | dict], window: int | None=None, on_response: typing.Callable | None=None) -> list:
+        """
+        send the commands over this connection and collect the responses in whatever order the server finishes them.
+        At most window commands are in flight at once, all of them if no window is given. Responses are returned in
+        the order the commands were given. on_response is called with the command index, response and seconds taken
+        """
+        queued = [command for command in map(self.command_operator, commands) if command]
+        window = window or len(queued)
+        request_ids, sent_at, responses = list(), dict(), dict()
+        while len(responses) < len(queued):
+            while len(request_ids) < len(queued) and len(request_ids) - len(responses) < window: # top the window back up
+                request_id = self.send_command(queued[len(request_ids)])
+                sent_at[request_id] = time.time()
+                request_ids.append(request_id)
+            response = self.special_forms_ops()
+            responses[response.request_id] = response
+            if on_response:
+                on_response(request_ids.index(response.request_id), response, time.time() - sent_at[response.request_id])
+            if response.exit_status: # the server ended the session, nothing else will be answered
+                break
+        return [responses.get(request_id) for request_id in request_ids]
+
+    def batch(self, file: str | None, parallel: int | None) -> list:
+        """
+        run a file of command lines (stdin if no file or '-' is given) over this one connection, with up to
+        parallel commands running on the server at once
+        """
+        parallel = parallel or 4
+        if self.max_in_flight and parallel > self.max_in_flight: # more would only queue on the server
+            print(f"[*] The server runs at most {self.max_in_flight} commands at once per CLI, using --parallel {self.max_in_flight}")
+            parallel = self.max_in_flight
+        if file and file != '-':
+            with open(file, 'r') as f:
+                lines = f.read().splitlines()
+        else:
+            lines = sys.stdin.read().splitlines()
+        commands, command_lines = list(), list()
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'): # blank lines and comments
+                continue
+            try:
+                commands.append(vars(self.parser.parse_args(self.process_command(line))))
+                command_lines.append(line)
+            except (argparse.ArgumentError, SystemExit, ValueError): # ValueError for unbalanced quotes
+                print(f"[-] Invalid Arguments, skipping: {line}")
+
+        def report(index, response, seconds):
+            print(f"[{index + 1}/{len(commands)}] {command_lines[index]} ({seconds:.2f}s)")
+            self.print_response(response.response_message)
+
+        start = time.time()
+        responses = self.pipeline(commands, window=parallel, on_response=report)
+        print(f"[+] Ran {len(commands)} commands in {time.time() - start:.2f}s with up to {parallel} in flight")
+        return responses
     
+    def answer(self, request) -> dict:
+        """
+        prompt the user for what a form, auth or confirmation request asks for and build the reply
+        """
+        if request.schema_type == 'FormRequest' and not request.arguments_list:
+            return SO.message('FormResponse', arguments_list=self.expression_input())
+        elif request.schema_type == 'FormRequest':
+            return SO.message('FormResponse', arguments_list=self.fillout_form(request.arguments_list))
+        elif request.schema_type == 'AuthRequest':
+            if not request.secure_input:
+                username = input("Username: ")
+                password = getpass("Password: ")
+            else:
+                username = None
+                password = getpass("Password: ")
+            return SO.message('AuthData', username=username, password=password)
+        print(request.message) # ConfirmationRequest
+        while True:
+            decision = str(input("(y/n)"))
+            if decision == 'y':
+                return SO.message('ResponseData', response_message=True)
+            elif decision == 'n':
+                return SO.message('ResponseData', response_message=False)
+            print("Enter valid response")
+
     def special_forms_ops(self):
         while True:
-            response = self.schema_unpack()
-            if response.schema_type == 'FormRequest' and not response.arguments_list:
-                form = self.expression_input()
-                filled_form = schemas.FormResponse(arguments_list=form)
-            elif response.schema_type == 'FormRequest':
-                form = self.fillout_form(response.arguments_list)
-                filled_form = schemas.FormResponse(arguments_list=form)
-            elif response.schema_type == 'AuthRequest':
-                if not response.secure_input:
-                    username = input("Username: ")
-                    password = getpass("Password: ")
-                else:
-                    username = None
-                    password = getpass("Password: ")
-                filled_form = schemas.AuthData(username=username, password=password)
-            elif response.schema_type == "ConfirmationRequest":
-                print(response.message)
-                while True:
-                    decision = str(input("(y/n)"))
-                    if decision == 'y':
-                        decision = True
-                        break
-                    elif decision == 'n':
-                        decision = False
-                        break
-                    else:
-                        print("Enter valid response")
-                filled_form = schemas.ResponseData(response_message=decision)
+            with self.interrupts_cancel():
+                response = self.schema_unpack()
+            if response.schema_type in ('FormRequest', 'AuthRequest', 'ConfirmationRequest'):
+                try:
+                    filled_form = self.answer(response)
+                except (KeyboardInterrupt, EOFError): # the command is blocked on this answer, so cancel it rather than leave it waiting
+                    sys.stdout.write("\n[*] Cancelling\n")
+                    self.json_send(SO.message('CancelData', request_id=response.request_id))
+                    continue # its cancelled response follows
+            elif response.schema_type == 'StreamData': # output from a command that is still running
+                self.print_response(response.message)
+                continue
             else:
+                self.in_flight.discard(response.request_id)
                 return response
-            self.json_send(filled_form.dict())
+            filled_form['request_id'] = response.request_id # the reply goes to the command that asked for it
+            self.json_send(filled_form)
 
     def print_response(self, response_message):
+        from pprint import pprint
         if type(response_message) == dict:
             for value in response_message.values():
                 if type(value) == dict:
@@ -205,27 +329,42 @@ class CLI(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup):
                 print("Invalid Arguments")
                 os._exit(0)
             kwargs = vars(kwargs)
+            if kwargs['command_group'] == 'batch': # batch runs on the client, fanning the commands out to the server
+                self.batch(kwargs['file'], kwargs['parallel'])
+                os._exit(0)
             command = self.command_operator(kwargs, exit_=1) # operate with args, send them over
-            self.json_send(command.dict())
+            self.send_command(command)
             response = self.special_forms_ops()
             if response.schema_type == 'ResponseData':
-                pprint(response.response_message)
-            pprint(response)
+                self.print_response(response.response_message)
             os._exit(0)
 
+        import pyfiglet
         title = pyfiglet.figlet_format("---------\nTapiconsole\n---------", font="slant") # print the title when CLI is accessed
         print(title)
         
         while True: # open the CLI if no arguments provided on startup
             try:
-                kwargs = self.process_command(str(input(f"[{self.username}@{self.url}] "))) # ask for and process user input
+                try:
+                    kwargs = self.process_command(self.prompt(f"[{self.username}@{self.url}] ")) # ask for and process user input
+                except ValueError as e: # unbalanced quotes, skipped like a bad line in a batch
+                    print(f"[-] Could not parse the command: {e}")
+                    continue
+                if kwargs and kwargs[0] == 'batch':
+                    try:
+                        batch_args = vars(self.parser.parse_args(kwargs))
+                    except (argparse.ArgumentError, SystemExit): # a bad flag must not end the interactive CLI
+                        print("[-] Invalid Arguments")
+                        continue
+                    self.batch(batch_args['file'], batch_args['parallel'])
+                    continue
                 try:
                     command = self.command_operator(kwargs) # run operations
                 except:
                     continue
                 if not command:
                     continue
-                self.json_send(command.dict())
+                self.send_command(command)
                 response = self.special_forms_ops()
                 if response.schema_type == 'ResponseData' and response.exit_status: # if the command was a shutdown or exit, close the program
                     print("[+] Exiting the cli")
@@ -233,8 +372,8 @@ class CLI(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup):
                 elif response.schema_type == 'ResponseData':
                     self.print_response(response.response_message)
             except KeyboardInterrupt:
-                pass # keyboard interrupts mess with the server, dont do it! it wont work anyway, hahahaha
-            except WindowsError: # if connection error with the server (there wont be any connection errors)
+                pass # Ctrl-C at the prompt just clears the line. While a command runs it cancels the command instead
+            except OSError: # if connection error with the server (there wont be any connection errors)
                 raise ConnectionError("[-] Connection was dropped. Exiting")
             except Exception as e: # if something else happens
                  print(e)
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+try:
+    from . import helpers
+    from . import SocketOpts as SO
+except:
+    import helpers
+    import SocketOpts as SO
+
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+STARTUP_TIMEOUT = 30 # seconds a freshly launched server gets to become ready
+FIRST_BACKOFF = 0.01 # seconds between readiness checks, growing up to MAX_BACKOFF
+MAX_BACKOFF = 0.25
+
+
+def state_path(port: int) -> str:
+    return os.path.join(helpers.app_path('server'), f'server-{port}.json')
+
+
+def log_path(port: int) -> str:
+    return os.path.join(helpers.app_path('server'), f'server-{port}.log')
+
+
+def write_state(port: int):
+    """
+    the readiness signal. Written once the server is listening and fully set up, so a client that sees it can
+    connect straight away
+    """
+    path = state_path(port)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump({'pid':os.getpid(), 'port':port, 'ready':time.time()}, f)
+    os.replace(temporary, path) # readers never see a half written file
+
+
+def read_state(port: int) -> dict | None:
+    try:
+        with open(state_path(port), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def clear_state(port: int):
+    state = read_state(port)
+    if state and state['pid'] == os.getpid(): # leave the file of a server that replaced this one alone
+        try:
+            os.remove(state_path(port))
+        except FileNotFoundError:
+            pass
+
+
+def try_connect(ip: str, port: int, transport: str) -> socket.socket | None:
+    """
+    a connected socket if a server is listening, otherwise None. A refused connect returns at once, so this is how an
+    already running server is detected
+    """
+    try:
+        return SO.connect(ip, port, transport)
+    except OSError:
+        return None
+
+
+def launch(port: int, transport: str) -> subprocess.Popen:
+    """
+    start the server as a detached process that outlives the client. It runs from its own directory, so the client
+    can be started from anywhere
+    """
+    options = dict()
+    if sys.platform.startswith('win'):
+        options['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        options['start_new_session'] = True # no SIGHUP when the terminal that launched it closes
+    return subprocess.Popen([sys.executable, SERVER_SCRIPT, '--port', str(port), '--transport', transport], cwd=os.path.dirname(SERVER_SCRIPT),
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            close_fds=True, **options)
+
+
+def wait_ready(process: subprocess.Popen, ip: str, port: int, transport: str,
+               timeout: float=STARTUP_TIMEOUT) -> tuple[socket.socket, dict | None]:
+    """
+    wait for the launched server's state file, checking with a growing backoff instead of hammering connect, then
+    connect to it. If the process exits first another server may have won the port, so one last connect is tried.
+    Returns the connection and the server's state
+    """
+    deadline = time.monotonic() + timeout
+    backoff = FIRST_BACKOFF
+    while time.monotonic() < deadline:
+        state = read_state(port)
+        if state and state['pid'] == process.pid:
+            connection = try_connect(ip, port, transport)
+            if connection:
+                return connection, state
+        if process.poll() is not None:
+            connection = try_connect(ip, port, transport)
+            if connection:
+                return connection, read_state(port)
+            raise ConnectionError(f"The server exited with status {process.returncode} before it was ready. See {log_path(port)}")
+        time.sleep(backoff)
+        backoff = min(backoff * 2, MAX_BACKOFF)
+    raise TimeoutError(f"The server did not become ready within {timeout} seconds")
@@ -1,25 +1,22 @@
 import typing
-import socket
+import os
 import sys
 import time
+import threading
 import functools
 from functools import update_wrapper, partial
 try:
     from . import helpers
-    from . import schemas
-    from . import SocketOpts
     from . import exceptions
 except:
     import helpers
-    import schemas
-    import SocketOpts
     import exceptions
 
+schemas = helpers.lazy_import('schemas', __package__) # the CLI uses the loading animation without ever needing pydantic
 
-class BaseRequirementDecorator(SocketOpts.SocketOpts, helpers.OperationsHelper):
-    connection: typing.Optional[socket.socket] = None
-    username: typing.Optional[str] = None
-    password: typing.Optional[str] = None
+
+class BaseRequirementDecorator(helpers.OperationsHelper):
+    context = threading.local() # per thread record of the session whose command is running on that thread
     def __init__(self, func: typing.Callable):
         update_wrapper(self, func)
         self.function = func
@@ -47,9 +44,9 @@ class RequiresForm(BaseRequirementDecorator):
         fields = list(helpers.get_parameters(self.function))
         if not fields:
             raise AttributeError(f"The decorated function {self.function} has no parameters.")
+        session = self.context.session
         form_request = schemas.FormRequest(arguments_list=fields)
-        self.json_send_explicit(BaseRequirementDecorator.connection, form_request.dict())
-        filled_form: schemas.FormResponse = self.schema_unpack_explicit(self.connection).arguments_list
+        filled_form: schemas.FormResponse = session.request(form_request).arguments_list
 
         return self.function(obj, **filled_form)
 
@@ -59,9 +56,11 @@ class RequiresExpression(BaseRequirementDecorator):
         fields = list(helpers.get_parameters(self.function))
         if 'expression' not in fields:
             raise AttributeError(f"The function {self.function} does not contain an 'expression' parameter")
+        if kwargs.get('expression') or kwargs.get('file'): # given with -e or -f, so it also runs one shot and in batches
+            return self.function(obj, **kwargs)
+        session = self.context.session
         form_request = schemas.FormRequest(arguments_list=[])
-        self.json_send_explicit(BaseRequirementDecorator.connection, form_request.dict())
-        filled_form: schemas.FormResponse = self.schema_unpack()
+        filled_form: schemas.FormResponse = session.request(form_request)
         kwargs['expression'] = filled_form.arguments_list
 
         return self.function(obj, **kwargs)
@@ -71,9 +70,9 @@ class SecureInput(BaseRequirementDecorator):
     def __call__(self, obj, *args, **kwargs):
         fields = list(helpers.get_parameters(self.function))
         if 'password' in fields:
+            session = self.context.session
             secure_input_request = schemas.AuthRequest(secure_input=True)
-            self.json_send_explicit(BaseRequirementDecorator.connection, secure_input_request.dict())
-            secure_input_data: schemas.AuthData = self.schema_unpack_explicit(self.connection)
+            secure_input_data: schemas.AuthData = session.request(secure_input_request)
             kwargs['password'] = secure_input_data.password
             return self.function(**kwargs)
         raise AttributeError(f"The function {self.function} does not contain a 'password' parameter")
@@ -84,16 +83,16 @@ class Auth(BaseRequirementDecorator):
         if self.function.__name__ == 'tapis_init' and kwargs['username'] and kwargs['password']:
             return self.function(obj, **kwargs)
         fields = list(helpers.get_parameters(self.function))
+        session = self.context.session
         auth_request = schemas.AuthRequest()
-        self.json_send_explicit(BaseRequirementDecorator.connection, auth_request.dict())
-        auth_data: schemas.AuthData = self.schema_unpack_explicit(self.connection)
+        auth_data: schemas.AuthData = session.request(auth_request)
         if 'username' in fields and 'password' in fields:
             kwargs['username'], kwargs['password'] = auth_data.username, auth_data.password
             return self.function(obj, **kwargs)
         username, password = auth_data.username, auth_data.password
-        if username != BaseRequirementDecorator.username:
+        if username != session.username:
             raise exceptions.InvalidCredentialsReceived(self.function, 'username')
-        elif password != BaseRequirementDecorator.password:    
+        elif not session.check_password(password):
             raise exceptions.InvalidCredentialsReceived(self.function, 'password')
 
         return self.function(obj, **kwargs)
@@ -101,9 +100,9 @@ class Auth(BaseRequirementDecorator):
 
 class NeedsConfirmation(BaseRequirementDecorator):
     def __call__(self, obj, *args, **kwargs):
+        session = self.context.session
         confirmation_request = schemas.ConfirmationRequest(message=f"You requested to {self.function.__name__}. Please confirm (y/n)")
-        self.json_send_explicit(BaseRequirementDecorator.connection, confirmation_request.dict())
-        confirmation_reply: schemas.ResponseData = self.schema_unpack_explicit(self.connection)
+        confirmation_reply: schemas.ResponseData = session.request(confirmation_request)
         confirmed = confirmation_reply.response_message
         if not confirmed:
             raise exceptions.NoConfirmationError(self.function)
@@ -111,14 +110,54 @@ class NeedsConfirmation(BaseRequirementDecorator):
     
 class TestDecorator(BaseRequirementDecorator):
     def __call__(self, obj, *args, **kwargs):
-        print(BaseRequirementDecorator.connection)
+        print(self.context.session.connection)
         return self.function(obj, **kwargs)
     
 class DecoratorSetup:
-    def configure_decorators(self):
-        BaseRequirementDecorator.connection = self.connection
-        BaseRequirementDecorator.username = self.username
-        BaseRequirementDecorator.password = self.password
+    def configure_decorators(self, request_id: int | None=None, cancelled: threading.Event | None=None,
+                             cwd: str | None=None):
+        """
+        make this session, and the command with this request id, the one the decorators talk to for everything run on the calling thread
+        """
+        BaseRequirementDecorator.context.session = self
+        BaseRequirementDecorator.context.request_id = request_id
+        BaseRequirementDecorator.context.cancelled = cancelled
+        BaseRequirementDecorator.context.cwd = cwd
+
+    @property
+    def session(self):
+        return getattr(BaseRequirementDecorator.context, 'session', None)
+
+    @property
+    def request_id(self) -> int | None:
+        return getattr(BaseRequirementDecorator.context, 'request_id', None)
+
+    @property
+    def cancelled(self) -> threading.Event | None:
+        """
+        set when the CLI asks to cancel the command running on this thread. Hand it to work that runs on other threads
+        """
+        return getattr(BaseRequirementDecorator.context, 'cancelled', None)
+
+    def check_cancelled(self):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise exceptions.Cancelled()
+
+    @property
+    def cwd(self) -> str | None:
+        """
+        the directory the CLI that sent the command running on this thread was in
+        """
+        return getattr(BaseRequirementDecorator.context, 'cwd', None)
+
+    def local_path(self, path: str | None) -> str | None:
+        """
+        a path on the user's machine as the server has to open it. Every shell shares one server running from its own
+        directory, so relative paths are taken from where the command was typed
+        """
+        if not path or not self.cwd:
+            return path
+        return os.path.join(self.cwd, os.path.expanduser(path))
     
 
 class AnimatedLoading:
@@ -138,19 +177,23 @@ class AnimatedLoading:
     def __str__(self):
         return str(self.function)
     
-    def animation(self):
+    def animation(self, stopped: threading.Event):
         while True:
             for frame in self.animation_frames:
                 sys.stdout.write(f'\rloading ' + frame)
                 sys.stdout.flush()
-                time.sleep(0.5)
+                if stopped.wait(0.5): # sleeps between frames, but wakes as soon as the work is done
+                    return
     
     def __call__(self, obj, *args, **kwargs):
-        animation_thread = helpers.KillableThread(target=self.animation)
+        stopped = threading.Event()
+        animation_thread = threading.Thread(target=self.animation, args=(stopped,), daemon=True)
         animation_thread.start()
-        result = self.function(obj, *args, **kwargs)
-        animation_thread.kill()
-        return result
+        try:
+            return self.function(obj, *args, **kwargs)
+        finally:
+            stopped.set()
+            animation_thread.join()
 
 
 if __name__ == "__main__":
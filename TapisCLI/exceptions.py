@@ -34,6 +34,23 @@ class Exit(Exception):
         super().__init__(f"exit initiated")
     
 
+class Cancelled(Exception):
+    """
+    raise error when the user cancels a running command. Commands check for this between chunks, pages and batches
+    """
+    def __init__(self, message: str="the command was cancelled"):
+        super().__init__(message)
+
+
+class ProtocolError(ConnectionError):
+    """
+    raise error when a frame cannot be from a CLI or server speaking this protocol. The connection is dropped, since
+    nothing after it can be trusted to line up
+    """
+    def __init__(self, message: str):
+        super().__init__(f"[-] {message}, closing the connection")
+
+
 class NoConfirmationError(Exception):
     """
     raise error when no confirmation is given for a function that needs confirmation to continue
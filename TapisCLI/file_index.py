@@ -0,0 +1,128 @@
+import os
+import re
+import time
+import typing
+import sqlite3
+import datetime
+import contextlib
+try:
+    from . import helpers
+    from . import transfers
+    from . import exceptions
+except:
+    import helpers
+    import transfers
+    import exceptions
+
+
+SIZE_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_modified(last_modified) -> float | None:
+    if not last_modified:
+        return None
+    return datetime.datetime.fromisoformat(str(last_modified).replace('Z', '+00:00')).timestamp()
+
+
+def parse_bound(expression: str, units: dict, default_unit: str) -> tuple[str, float]:
+    """
+    find style bounds: '+10M' is more than 10MB, '-2d' is less than 2 days, '100' is exactly 100
+    """
+    match = re.fullmatch(r'([+-]?)(\d+(?:\.\d+)?)([a-zA-Z]?)', expression.strip())
+    if not match or (match.group(3) or default_unit) not in units:
+        raise ValueError(f"Invalid bound {expression}. Use +N or -N followed by one of {', '.join(unit for unit in units if unit)}")
+    sign, number, unit = match.groups()
+    return {'+':'>', '-':'<', '':'='}[sign], float(number) * units[unit or default_unit]
+
+
+class FileIndex:
+    """
+    local sqlite mirror of the file trees on tapis systems, so name, size and age lookups never go back to tapis
+    """
+    def __init__(self, path: str | None=None):
+        self.path = path or os.path.join(helpers.app_path('index'), 'files.db')
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL") # finds can read while a crawl writes
+            connection.execute("""CREATE TABLE IF NOT EXISTS files (
+                system TEXT, path TEXT, name TEXT, type TEXT, size INTEGER, modified REAL, crawl INTEGER,
+                PRIMARY KEY (system, path))""")
+            connection.execute("CREATE INDEX IF NOT EXISTS files_name ON files (system, name)")
+            connection.execute("CREATE INDEX IF NOT EXISTS files_size ON files (system, size)")
+            connection.execute("CREATE INDEX IF NOT EXISTS files_modified ON files (system, modified)")
+            connection.execute("""CREATE TABLE IF NOT EXISTS crawls (
+                system TEXT, root TEXT, finished REAL, entries INTEGER, PRIMARY KEY (system, root))""")
+
+    @contextlib.contextmanager
+    def connect(self) -> typing.Iterator[sqlite3.Connection]:
+        """
+        a connection that commits on success and is closed either way. sqlite3's own context manager only commits,
+        which on the long running server leaks a file descriptor per crawl and find
+        """
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as connection, connection:
+            yield connection
+
+    def crawl(self, t, system_id: str, root: str, report=None, cancelled=None) -> tuple[int, int]:
+        """
+        refresh the index under root from paged recursive listings. This is a full refresh of the subtree: every entry
+        is listed and upserted page by page, and whatever was under root before but is gone now gets dropped. Returns the entries seen and the entries removed.
+        A cancelled crawl keeps the pages it already stored but removes nothing, since it did not see everything
+        """
+        root = root.strip('/')
+        crawl_id = time.time_ns()
+        seen, offset = 0, 0
+        with self.connect() as connection:
+            while True:
+                if cancelled is not None and cancelled.is_set():
+                    raise exceptions.Cancelled(f"crawl cancelled after {seen} entries under /{root}")
+                page = t.files.listFiles(systemId=system_id, path=root or '/', recurse=True,
+                                         limit=transfers.PAGE_SIZE, offset=offset)
+                connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       [(system_id, entry.path.strip('/'), entry.name, entry.type, entry.size,
+                                         parse_modified(getattr(entry, 'lastModified', None)), crawl_id)
+                                        for entry in page])
+                connection.commit()
+                seen += len(page)
+                if report:
+                    report(f"indexed {seen} entries under /{root}")
+                if len(page) < transfers.PAGE_SIZE:
+                    break
+                offset += transfers.PAGE_SIZE
+            prefix = f"{root}/" if root else ''
+            removed = connection.execute("""DELETE FROM files WHERE system = ? AND crawl != ?
+                                            AND (path = ? OR substr(path, 1, ?) = ?)""",
+                                         (system_id, crawl_id, root, len(prefix), prefix)).rowcount
+            connection.execute("INSERT OR REPLACE INTO crawls VALUES (?, ?, ?, ?)", (system_id, root, time.time(), seen))
+        return seen, removed
+
+    def find(self, system_id: str, root: str | None=None, name: str | None=None, size: str | None=None,
+             age: str | None=None, limit: int=1000) -> list[tuple]:
+        """
+        (path, type, size, modified) rows matching every filter that was given. name is a glob, size and age are find
+        style bounds like +10M or -2d
+        """
+        clauses, parameters = ["system = ?"], [system_id]
+        if root and root.strip('/'):
+            prefix = f"{root.strip('/')}/"
+            clauses.append("substr(path, 1, ?) = ?")
+            parameters += [len(prefix), prefix]
+        if name:
+            clauses.append("name GLOB ?")
+            parameters.append(name)
+        if size:
+            operator, bound = parse_bound(size, SIZE_UNITS, '')
+            clauses.append(f"size {operator} ?")
+            parameters.append(bound)
+        if age: # age is measured back from now, so more than N old means modified before now - N
+            operator, bound = parse_bound(age, AGE_UNITS, 'd')
+            operator = {'>':'<', '<':'>', '=':'='}[operator]
+            clauses.append(f"modified {operator} ?")
+            parameters.append(time.time() - bound)
+        with self.connect() as connection:
+            return connection.execute(f"""SELECT path, type, size, modified FROM files WHERE {' AND '.join(clauses)}
+                                          ORDER BY path LIMIT ?""", (*parameters, limit)).fetchall()
+
+    def last_crawl(self, system_id: str) -> float | None:
+        with self.connect() as connection:
+            row = connection.execute("SELECT max(finished) FROM crawls WHERE system = ?", (system_id,)).fetchone()
+        return row[0]
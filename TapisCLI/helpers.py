@@ -1,12 +1,9 @@
 import typing
+import os
 import sys
 import threading
-from TypeEnforcement.type_enforcer import TypeEnforcer
+import importlib.util
 import re
-import json
-import argparse
-from urllib.request import urlopen
-import socket
 try:
     from . import exceptions
     from . import args
@@ -16,6 +13,46 @@ except:
 
 
 command_parameters = args.Args.argparser_args
+APP_DIRECTORY = os.path.join(os.path.expanduser('~'), '.tapis-cli') # local state kept between runs: manifests, indexes
+
+
+def app_path(*parts: str) -> str:
+    """
+    directory under the app directory, created if it does not exist yet
+    """
+    path = os.path.join(APP_DIRECTORY, *parts)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+def lazy_import(name: str, package: str | None=None):
+    """
+    a module that is only really imported the first time one of its attributes is used. Keeps heavy dependencies
+    off the startup path of code that may never touch them
+    """
+    name = f"{package}.{name}" if package else name
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+lazy_lock = threading.Lock()
+
+
+def load(module):
+    """
+    finish loading a lazy module now. LazyLoader is not thread safe before python 3.12: a second thread touching the
+    module while the first is still loading it sees it half empty. Code that shares a lazy module across threads loads
+    it through here before any of them can use it
+    """
+    with lazy_lock:
+        getattr(module, '__name__') # any attribute access runs the real import
+    return module
 
 
 def get_parameters(func):
@@ -25,9 +62,9 @@ def get_parameters(func):
     return args
 
 class OperationsHelper:
-    def filter_kwargs(self, func: typing.Callable, kwargs: dict) -> dict:
+    def filter_kwargs(self, func: typing.Callable, kwargs: dict, parameters: list | None=None) -> dict:
         filtered = dict()
-        variables = list(get_parameters(func))
+        variables = parameters if parameters is not None else get_parameters(func) # registered commands pass theirs in
         for arg in variables:
             if arg != "password": filtered.update({arg:kwargs[arg]})
             else: filtered.update({'password':None})
@@ -43,6 +80,8 @@ class DynamicHelpUtility:
     dynamically generate the help menu based on the doc  string and function arguments using .__doc__ and .__code__
     to generate helps for each command, iterate over the command map of the selected tapis wrapper object, and generate separate help menu for each
     """
+    registries = dict() # class -> its command registry, worked out for the first instance and shared by the rest
+
     def __locate_docstring_help(self, func: typing.Callable | object, command_name: str) -> str:
         docstring_components = func.__doc__
         if docstring_components:
@@ -77,7 +116,7 @@ class DynamicHelpUtility:
             command_help['description'] = self.__locate_docstring_help(command, command_name)
             arguments = get_parameters(command)
             if self.__class__.__name__ != 'Server': 
-                argument_help = f"{self.__class__.__name__.lower()} -c {command_name}"
+                argument_help = f"{getattr(self, 'group_name', self.__class__.__name__.lower())} -c {command_name}"
             else:
                 if map == self.command_map:
                     argument_help = f"{command_name}"
@@ -90,42 +129,27 @@ class DynamicHelpUtility:
             help_menu[command_name] = command_help
         return help_menu
             
+    def command_registry(self) -> dict:
+        """
+        the help menu and the parameters of every command in the command map. Docstrings and signatures are read
+        once per class rather than once per instance, and dispatch looks the parameters up here instead of
+        introspecting the command on every call
+        """
+        registry = DynamicHelpUtility.registries.get(type(self))
+        if registry is None:
+            help = self.help_generation()
+            if isinstance(help, tuple): # the server's menu covers its command groups as well as its own commands
+                help = dict(help[0], **help[1])
+            registry = {'help':help,
+                        'parameters':{name:get_parameters(command) for name, command in self.command_map.items()}}
+            DynamicHelpUtility.registries[type(self)] = registry
+        return registry
+
     def help_generation(self) -> dict:
         if self.__class__.__name__ != 'Server': 
             return self.__tapis_service_commands_help_gen(map=self.command_map)
         else:
             return self.__server_commands_help_gen(map=self.command_group_map), self.__server_commands_help_gen(map=self.command_map)
-    
-
-class KillableThread(threading.Thread):
-    def __init__(self, *args, **keywords):
-        threading.Thread.__init__(self, *args, **keywords)
-        self.killed = False
-
-    def start(self):
-        self.__run_backup = self.run
-        self.run = self.__run     
-        threading.Thread.start(self)
-
-    def __run(self):
-        sys.settrace(self.globaltrace)
-        self.__run_backup()
-        self.run = self.__run_backup
-
-    def globaltrace(self, frame, event, arg):
-        if event == 'call':
-            return self.localtrace
-        else:
-            return None
-
-    def localtrace(self, frame, event, arg):
-        if self.killed:
-            if event == 'line':
-                raise SystemExit()
-        return self.localtrace
-
-    def kill(self):
-        self.killed = True
 
 
 if __name__ == "__main__":
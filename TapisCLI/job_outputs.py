@@ -0,0 +1,142 @@
+import os
+import time
+import codecs
+import typing
+import tarfile
+import threading
+import posixpath
+from tapipy import errors as tapis_errors
+try:
+    from . import transfers
+    from . import exceptions
+    from . import job_watcher
+except:
+    import transfers
+    import exceptions
+    import job_watcher
+
+
+TAIL_INTERVAL = 2.0 # seconds between looks at a growing output file, doubled while nothing new arrives
+MAX_TAIL_INTERVAL = 30.0
+
+
+def output_file(t, job_uuid: str, name: str='tapisjob.out') -> tuple[str, str]:
+    """
+    the system and path a job writes its output to. While the job runs that is its execution system
+    """
+    job = t.jobs.getJob(jobUuid=job_uuid)
+    return job.execSystemId, posixpath.join(job.execSystemOutputDir, name)
+
+
+def read_from(t, url: str, offset: int, size: int, chunk_size: int=transfers.CHUNK_SIZE) -> typing.Iterator[bytes]:
+    """
+    the bytes of a remote file from offset up to size, a chunk at a time
+    """
+    headers = dict(transfers.auth_headers(t), **transfers.byte_range(offset, size))
+    with t.requests_session.get(url, headers=headers, stream=True, verify=t.verify) as response:
+        transfers.raise_for_status(response)
+        skip = offset if transfers.range_ignored(response, offset) else 0 # drop what was already seen
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk, skip = chunk[dropped:], skip - dropped
+            if chunk:
+                yield chunk
+
+
+def tail(t, job_uuid: str, emit: typing.Callable[[str], typing.Any], destination: str | None=None,
+         cancelled: threading.Event | None=None, interval: float=TAIL_INTERVAL) -> tuple[int, str]:
+    """
+    follow a job's output as it grows, fetching only the bytes added since the last look, until the job reaches a
+    terminal state and everything it wrote has been read. Text goes to emit, and the raw bytes are also written to
+    destination if one is given. Returns the bytes read and the job's final state
+    """
+    system_id, path = output_file(t, job_uuid)
+    url = transfers.content_url(t, system_id, path)
+    decoder = codecs.getincrementaldecoder('utf-8')('replace') # chunks can end in the middle of a character
+    offset, wait = 0, interval
+    sink = open(destination, 'wb') if destination else None
+    try:
+        while True:
+            status = t.jobs.getJobStatus(jobUuid=job_uuid).status # read before the size, so nothing written after is missed
+            try:
+                size = transfers.remote_size(t, system_id, path) or 0
+            except tapis_errors.NotFoundError: # the job has not started writing yet
+                size = 0
+            if size > offset:
+                for chunk in read_from(t, url, offset, size):
+                    if sink:
+                        sink.write(chunk)
+                    if text := decoder.decode(chunk):
+                        emit(text)
+                    offset += len(chunk)
+                wait = interval
+            elif status in job_watcher.TERMINAL_STATES:
+                if text := decoder.decode(b'', final=True):
+                    emit(text)
+                return offset, status
+            else:
+                wait = min(wait * 2, MAX_TAIL_INTERVAL)
+            if cancelled is not None:
+                if cancelled.wait(wait):
+                    raise exceptions.Cancelled(f"stopped following {job_uuid} after {offset} bytes")
+            else:
+                time.sleep(wait)
+    finally:
+        if sink:
+            sink.close()
+
+
+class ProgressReader:
+    """
+    file like view of a response body that counts what is read through it, so archive downloads report progress
+    and notice a cancel like any other transfer
+    """
+    def __init__(self, raw, progress: transfers.TransferProgress):
+        self.raw = raw
+        self.progress = progress
+
+    def read(self, size: int=-1) -> bytes:
+        data = self.raw.read(size)
+        self.progress.update(len(data))
+        return data
+
+
+def extract_archive(t, job_uuid: str, destination: str, report: typing.Callable | None=None,
+                    cancelled: threading.Event | None=None) -> transfers.TransferProgress:
+    """
+    download a job's whole output directory as a tar.gz stream and unpack it on the fly. Members are written out as
+    they come off the wire, so memory holds one block no matter how large the outputs are
+    """
+    url = transfers.job_output_url(t, job_uuid, '')
+    with t.requests_session.get(url, headers=transfers.auth_headers(t), params={'compress':'true', 'format':'tar.gz'},
+                                stream=True, verify=t.verify) as response:
+        transfers.raise_for_status(response)
+        response.raw.decode_content = True # undo any transfer encoding, the gzip layer is the archive's own
+        progress = transfers.TransferProgress(job_uuid, None, report, cancelled=cancelled)
+        os.makedirs(destination, exist_ok=True)
+        with tarfile.open(fileobj=ProgressReader(response.raw, progress), mode='r|gz') as archive:
+            for member in archive:
+                if not (member.isfile() or member.isdir()) or member.name.startswith('/') or '..' in member.name.split('/'):
+                    continue # plain files and directories only, and nothing lands outside the destination
+                archive.extract(member, destination)
+    return progress
+
+
+def output_files(t, job_uuid: str, path: str='') -> typing.Iterator[tuple[str, typing.Any]]:
+    """
+    (path relative to the output directory, listing entry) for every file in a job's outputs, walking
+    subdirectories through paged listings
+    """
+    skip = 0
+    while True:
+        page = t.jobs.getJobOutputList(jobUuid=job_uuid, outputPath=path or '/', limit=transfers.PAGE_SIZE, skip=skip)
+        for entry in page:
+            relative = posixpath.join(path, entry.name)
+            if entry.type == 'dir':
+                yield from output_files(t, job_uuid, relative)
+            else:
+                yield relative, entry
+        if len(page) < transfers.PAGE_SIZE:
+            return
+        skip += transfers.PAGE_SIZE
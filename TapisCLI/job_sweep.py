@@ -0,0 +1,133 @@
+import os
+import re
+import csv
+import json
+import time
+import typing
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from tapipy import errors as tapis_errors
+try:
+    from . import helpers
+except:
+    import helpers
+
+
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}') # {{name}} in a template string
+RATE = 10.0 # job submissions per second
+RETRIES = 4
+TRANSIENT_STATUS = {429, 502, 503, 504} # submits are not idempotent, so a plain 500 that may have created the job is not retried
+
+
+def parameter_sets(path: str) -> list[dict]:
+    """
+    the parameters for every job of a sweep. A .csv gives one job per row, a .json object of name -> list of values
+    gives one job per combination
+    """
+    if path.rsplit('.', 1)[-1].lower() == 'csv':
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+    with open(path, 'r', encoding='utf-8') as f:
+        grid = json.load(f)
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def render(template, parameters: dict):
+    """
+    the template with every {{name}} filled in. A string that is nothing but a placeholder takes the value as is,
+    so numbers and lists keep their type
+    """
+    if isinstance(template, dict):
+        return {key:render(value, parameters) for key, value in template.items()}
+    if isinstance(template, list):
+        return [render(value, parameters) for value in template]
+    if not isinstance(template, str):
+        return template
+    whole = PLACEHOLDER.fullmatch(template.strip())
+    if whole:
+        return parameters[whole.group(1)]
+    return PLACEHOLDER.sub(lambda match: str(parameters[match.group(1)]), template)
+
+
+def placeholders(template) -> set[str]:
+    return set(PLACEHOLDER.findall(json.dumps(template)))
+
+
+class RateLimiter:
+    """
+    spaces calls out to at most rate per second across every thread that shares it
+    """
+    def __init__(self, rate: float=RATE):
+        self.interval = 1 / rate
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def transient(error: Exception) -> bool:
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, tapis_errors.ServiceUnavailableError)):
+        return True
+    response = getattr(error, 'response', None)
+    return isinstance(error, tapis_errors.BaseTapyException) and getattr(response, 'status_code', None) in TRANSIENT_STATUS
+
+
+def submit_with_retries(submit: typing.Callable[[dict], typing.Any], descriptor: dict, limiter: RateLimiter,
+                        retries: int=RETRIES, backoff: float=1.0):
+    for attempt in range(1, retries + 1):
+        limiter.acquire()
+        try:
+            return submit(descriptor)
+        except Exception as e:
+            if attempt == retries or not transient(e):
+                raise
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def sweep(submit: typing.Callable[[dict], typing.Any], template: dict, parameters: list[dict], parallel: int=8,
+          rate: float=RATE, report: typing.Callable | None=None, interval: float=1.0,
+          cancelled: threading.Event | None=None) -> list[dict]:
+    """
+    render a job descriptor per parameter set and submit them on parallel threads, no faster than rate per second.
+    Returns a manifest entry per job with its parameters and either the uuid it got or the error it ended with.
+    Jobs not yet submitted when the sweep is cancelled are recorded as such
+    """
+    missing = placeholders(template) - {'index'} - set(parameters[0] if parameters else ())
+    if missing:
+        raise ValueError(f"The template uses {', '.join(sorted(missing))}, which the parameters do not give")
+    limiter = RateLimiter(rate)
+    manifest = [{'index':index, 'parameters':values, 'uuid':None, 'error':None} for index, values in enumerate(parameters)]
+
+    def run(entry: dict):
+        if cancelled is not None and cancelled.is_set():
+            entry['error'] = 'cancelled before submission'
+            return
+        descriptor = render(template, dict(entry['parameters'], index=entry['index']))
+        entry['uuid'] = submit_with_retries(submit, descriptor, limiter).uuid
+
+    start = last_report = time.time()
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="job-submit") as pool:
+        futures = {pool.submit(run, entry):entry for entry in manifest}
+        for finished, future in enumerate(as_completed(futures), start=1):
+            if future.exception():
+                futures[future]['error'] = str(future.exception())
+            if report and time.time() - last_report >= interval:
+                last_report = time.time()
+                report(f"{finished}/{len(manifest)} jobs submitted at {finished / (last_report - start):.1f}/s")
+    return manifest
+
+
+def write_manifest(manifest: list[dict], path: str | None=None) -> str:
+    path = path or os.path.join(helpers.app_path('sweeps'), f"sweep-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return path
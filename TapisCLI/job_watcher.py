@@ -0,0 +1,226 @@
+import time
+import typing
+import threading
+from tapipy import errors as tapis_errors
+try:
+    from . import exceptions
+except:
+    import exceptions
+
+
+TERMINAL_STATES = {'FINISHED', 'CANCELLED', 'FAILED'}
+# seconds between polls of a job in each state. Jobs change quickly while they are being set up and torn down, and
+# can sit queued or running for hours
+POLL_INTERVALS = {
+    'PENDING':5, 'PROCESSING_INPUTS':5, 'STAGING_INPUTS':10, 'STAGING_JOB':5, 'SUBMITTING_JOB':5,
+    'QUEUED':30, 'RUNNING':20, 'ARCHIVING':10, 'BLOCKED':60, 'PAUSED':60
+}
+DEFAULT_INTERVAL = 15
+BACKOFF = 1.5 # every poll that finds the state unchanged stretches the interval by this much
+MAX_INTERVAL = 300
+BATCH_SIZE = 50 # jobs asked about in one search request
+MAX_FAILURES = 5 # polls in a row that can fail before a job is given up on
+PERMANENT_ERRORS = (tapis_errors.NotFoundError, tapis_errors.ForbiddenError, tapis_errors.BadRequestError)
+UNSUPPORTED_SEARCH = (tapis_errors.BadRequestError, tapis_errors.InvalidInputError) # the tenant cannot do the uuid search
+
+
+class WatchedJob:
+    def __init__(self, uuid: str):
+        self.uuid = uuid
+        self.status = None
+        self.interval = 0
+        self.next_poll = 0 # due at once, so a new job's state is known right away
+        self.polls = 0
+        self.failures = 0
+        self.error = None # why the job's state could not be had, which ends watching it
+        self.changed = time.time()
+
+    def update(self, status: str) -> bool:
+        """
+        record a poll. Returns whether the state changed. An unchanged state backs off the next poll, a new one
+        starts over at that state's interval
+        """
+        self.polls += 1
+        self.failures = 0
+        changed = status != self.status
+        if changed:
+            self.status, self.changed = status, time.time()
+            self.interval = POLL_INTERVALS.get(status, DEFAULT_INTERVAL)
+        else:
+            self.interval = min(self.interval * BACKOFF, MAX_INTERVAL)
+        self.next_poll = time.monotonic() + self.interval
+        return changed
+
+    def fail(self, error: Exception) -> bool:
+        """
+        record a poll that could not get the state. A job tapis does not know or will not show, or one that keeps
+        failing, ends with the error instead of being waited on forever. Returns whether it ended
+        """
+        self.polls += 1
+        self.failures += 1
+        if isinstance(error, PERMANENT_ERRORS) or self.failures >= MAX_FAILURES:
+            self.error, self.changed = str(error), time.time()
+            return True
+        self.next_poll = time.monotonic() + max(self.interval, DEFAULT_INTERVAL)
+        return False
+
+    @property
+    def terminal(self) -> bool:
+        return self.error is not None or self.status in TERMINAL_STATES
+
+    @property
+    def state(self) -> str | None:
+        return 'ERROR' if self.error is not None else self.status
+
+    def describe(self) -> str:
+        return f"[job {self.uuid}] {self.state}" + (f": {self.error}" if self.error is not None else '')
+
+
+class JobWatcher:
+    """
+    polls every watched job from one background thread. Jobs that come due together are asked about in one search
+    request, however many commands are watching or waiting on them. State changes go to every subscriber and wake
+    the waiters. Terminal jobs stop being polled. A stopped watcher starts polling again as soon as it is used, since
+    sessions can outlive the login that built it
+    """
+    def __init__(self, t, logger=None):
+        self.t = t
+        self.logger = logger
+        self.jobs = dict() # uuid -> WatchedJob
+        self.subscribers = list() # callables taking a state change message
+        self.condition = threading.Condition()
+        self.thread = None
+        self.generation = 0 # bumped by stop, a polling thread from an older generation exits
+        self.batched = True # cleared if the tenant's jobs service rejects the uuid search
+        self.requests = 0
+
+    def watch(self, uuids: typing.Iterable[str], notify: typing.Callable[[str], typing.Any] | None=None) -> list[WatchedJob]:
+        with self.condition:
+            watched = [self.jobs.setdefault(uuid, WatchedJob(uuid)) for uuid in uuids]
+            if notify and notify not in self.subscribers:
+                self.subscribers.append(notify)
+            self.start()
+            self.condition.notify_all() # new jobs are due at once
+        return watched
+
+    def start(self):
+        """
+        make sure a polling thread is running. Called with the condition held
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, args=(self.generation,), name="job-watcher", daemon=True)
+            self.thread.start()
+
+    def wait(self, uuids: list[str], cancelled: threading.Event | None=None,
+             report: typing.Callable[[str], typing.Any] | None=None) -> dict:
+        """
+        block until every one of the jobs is in a terminal state or ended with an error, reporting their changes on
+        the way. Returns uuid -> final state, ERROR for the jobs whose state could not be had
+        """
+        watched = self.watch(uuids)
+        seen = {job.uuid:None for job in watched}
+        while True:
+            with self.condition:
+                self.start() # the watcher may have been stopped under a waiter that is still around
+                changes = list()
+                for job in watched:
+                    if job.state != seen[job.uuid]:
+                        seen[job.uuid] = job.state
+                        if job.state:
+                            changes.append(job.describe())
+                done = all(job.terminal for job in watched)
+                if not changes and not done and not (cancelled is not None and cancelled.is_set()):
+                    self.condition.wait(timeout=1) # woken by every poll round, the timeout is only for noticing a cancel
+                    continue
+            for message in changes: # sent outside the lock, a slow CLI must not hold up the poller
+                if report:
+                    report(message)
+            if done:
+                return {job.uuid:job.state for job in watched}
+            if cancelled is not None and cancelled.is_set():
+                raise exceptions.Cancelled(f"stopped waiting with {sum(not job.terminal for job in watched)} jobs still running")
+
+    def due(self) -> list[WatchedJob]:
+        now = time.monotonic()
+        return [job for job in self.jobs.values() if not job.terminal and job.next_poll <= now]
+
+    def poll(self, jobs: list[WatchedJob]) -> dict:
+        """
+        uuid -> status, or the error asking about it raised, for the jobs, in as few requests as the jobs service
+        allows. Jobs a search round misses are asked about one at a time, which tells unknown jobs from a failed search
+        """
+        statuses = dict()
+        if self.batched:
+            for start in range(0, len(jobs), BATCH_SIZE):
+                batch = [job.uuid for job in jobs[start:start + BATCH_SIZE]]
+                self.requests += 1
+                try:
+                    found = self.t.jobs.getJobSearchList(search=f"(uuid.in.{','.join(batch)})", select='uuid,status',
+                                                         limit=len(batch))
+                except UNSUPPORTED_SEARCH as e:
+                    self.batched = False
+                    if self.logger:
+                        self.logger.warning(f"Job search unavailable, polling jobs one at a time: {e}")
+                    break
+                except Exception as e: # this round only, its jobs are asked about one at a time below
+                    if self.logger:
+                        self.logger.warning(f"Job search failed: {e}")
+                    continue
+                statuses.update({job.uuid:job.status for job in found})
+        for job in jobs:
+            if job.uuid in statuses:
+                continue
+            self.requests += 1
+            try:
+                statuses[job.uuid] = self.t.jobs.getJobStatus(jobUuid=job.uuid).status
+            except Exception as e: # one job failing does not hold up the rest
+                statuses[job.uuid] = e
+        return statuses
+
+    def run(self, generation: int):
+        while True:
+            with self.condition:
+                while generation == self.generation and not self.due():
+                    pending = [job.next_poll for job in self.jobs.values() if not job.terminal]
+                    self.condition.wait(timeout=max(min(pending) - time.monotonic(), 0.01) if pending else None)
+                if generation != self.generation:
+                    return
+                jobs = self.due()
+            statuses = self.poll(jobs) # outside the lock so watchers and waiters are never held up by tapis
+            changes = list()
+            with self.condition:
+                for job in jobs:
+                    status = statuses.get(job.uuid)
+                    if isinstance(status, Exception):
+                        if self.logger:
+                            self.logger.warning(f"Polling job {job.uuid} failed: {status}")
+                        if job.fail(status):
+                            changes.append(job.describe())
+                    elif job.update(status):
+                        changes.append(job.describe())
+                subscribers = list(self.subscribers)
+                self.condition.notify_all()
+            for message in changes:
+                for notify in subscribers:
+                    try:
+                        notify(message)
+                    except (ConnectionError, OSError): # the CLI went away, stop telling it things
+                        with self.condition:
+                            if notify in self.subscribers:
+                                self.subscribers.remove(notify)
+
+    def stats(self) -> dict:
+        with self.condition:
+            now = time.monotonic()
+            return {job.uuid:{'status':job.state, 'error':job.error, 'polls':job.polls,
+                              'next_poll_seconds':None if job.terminal else round(max(job.next_poll - now, 0), 1)}
+                    for job in self.jobs.values()}
+
+    def stop(self):
+        """
+        end the polling thread. Watched jobs are kept, and the next watch or a waiter still around starts a new one
+        """
+        with self.condition:
+            self.generation += 1
+            self.thread = None
+            self.condition.notify_all()
@@ -0,0 +1,206 @@
+import os
+import time
+import bisect
+import threading
+import contextlib
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # latency histogram upper bounds in seconds
+BACKGROUND = '(background)' # tapis calls made off a command's thread: worker pools, the job watcher, token refreshes
+UNKNOWN = 'unknown' # every command that is not registered, so whatever a client sends cannot grow the metrics
+DUMP_INTERVAL = 15 # seconds between rewrites of the prometheus dump file
+
+
+class CommandMetrics:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1) # the last one catches everything slower than the largest bound
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.api_calls = 0
+
+    def quantile(self, q: float) -> float | None:
+        """
+        the bucket bound that q of the calls finished within
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self) -> dict:
+        return {'count':self.count, 'errors':self.errors,
+                'mean_seconds':round(self.seconds / self.count, 4) if self.count else None,
+                'p50_seconds':self.quantile(0.5), 'p95_seconds':self.quantile(0.95),
+                'bytes_sent':self.bytes_sent, 'bytes_received':self.bytes_received, 'api_calls':self.api_calls}
+
+
+class Traffic:
+    """
+    what one command moved while it ran: socket bytes and tapis calls. Lives on the command's thread
+    """
+    def __init__(self, bytes_received: int=0):
+        self.key = None
+        self.bytes_sent = 0
+        self.bytes_received = bytes_received
+        self.api_calls = 0
+
+
+class Metrics:
+    """
+    latency histograms, error counts, socket bytes and tapis call counts per command, keyed 'group.command' for the
+    service wrappers and by name for the server's own commands. Recording is a dict lookup and a few additions
+    under a lock, so it stays on. TAPIS_CLI_METRICS=0 turns it off
+    """
+    def __init__(self, enabled: bool=True):
+        self.enabled = enabled
+        self.commands = dict() # key -> CommandMetrics
+        self.lock = threading.Lock()
+        self.context = threading.local()
+        self.started = time.time()
+
+    def entry(self, key: str) -> CommandMetrics:
+        entry = self.commands.get(key)
+        if entry is None:
+            entry = self.commands.setdefault(key, CommandMetrics())
+        return entry
+
+    @contextlib.contextmanager
+    def scope(self, bytes_received: int=0):
+        """
+        collect the traffic of the command run on this thread, from its request frame to its response, and book it
+        against the first command measured inside
+        """
+        if not self.enabled:
+            yield None
+            return
+        traffic = self.context.traffic = Traffic(bytes_received)
+        try:
+            yield traffic
+        finally:
+            self.context.traffic = None
+            if traffic.key:
+                with self.lock:
+                    entry = self.entry(traffic.key)
+                    entry.bytes_sent += traffic.bytes_sent
+                    entry.bytes_received += traffic.bytes_received
+                    entry.api_calls += traffic.api_calls
+
+    @contextlib.contextmanager
+    def measure(self, key: str):
+        """
+        time the command and count it as an error if it raises
+        """
+        if not self.enabled:
+            yield
+            return
+        traffic = getattr(self.context, 'traffic', None)
+        if traffic is not None and traffic.key is None:
+            traffic.key = key
+        start, failed = time.perf_counter(), False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                entry = self.entry(key)
+                entry.count += 1
+                entry.errors += failed
+                entry.seconds += seconds
+                entry.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def error(self, key: str):
+        """
+        count a failure that the command turned into a normal response instead of raising
+        """
+        if self.enabled:
+            with self.lock:
+                self.entry(key).errors += 1
+
+    def sent(self, count: int):
+        traffic = getattr(self.context, 'traffic', None)
+        if traffic is not None:
+            traffic.bytes_sent += count
+
+    def api_call(self, response, *args, **kwargs):
+        """
+        requests response hook, installed on every tapis client's session
+        """
+        traffic = getattr(self.context, 'traffic', None)
+        if traffic is not None:
+            traffic.api_calls += 1
+        elif self.enabled:
+            with self.lock:
+                self.entry(BACKGROUND).api_calls += 1
+        return response
+
+    def instrument(self, t):
+        hooks = t.requests_session.hooks['response']
+        if self.api_call not in hooks:
+            hooks.append(self.api_call)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {'uptime_seconds':round(time.time() - self.started),
+                    'commands':{key:entry.summary() for key, entry in sorted(self.commands.items())}}
+
+    def prometheus(self) -> str:
+        """
+        the metrics in the prometheus text exposition format
+        """
+        lines = ['# TYPE tapis_cli_command_seconds histogram', '# TYPE tapis_cli_command_errors_total counter',
+                 '# TYPE tapis_cli_bytes_sent_total counter', '# TYPE tapis_cli_bytes_received_total counter',
+                 '# TYPE tapis_cli_api_calls_total counter']
+        with self.lock:
+            for key, entry in sorted(self.commands.items()):
+                label = f'command="{key}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, entry.buckets):
+                    cumulative += count
+                    lines.append(f'tapis_cli_command_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'tapis_cli_command_seconds_bucket{{{label},le="+Inf"}} {entry.count}')
+                lines.append(f'tapis_cli_command_seconds_sum{{{label}}} {entry.seconds:.6f}')
+                lines.append(f'tapis_cli_command_seconds_count{{{label}}} {entry.count}')
+                lines.append(f'tapis_cli_command_errors_total{{{label}}} {entry.errors}')
+                lines.append(f'tapis_cli_bytes_sent_total{{{label}}} {entry.bytes_sent}')
+                lines.append(f'tapis_cli_bytes_received_total{{{label}}} {entry.bytes_received}')
+                lines.append(f'tapis_cli_api_calls_total{{{label}}} {entry.api_calls}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temporary, path) # scrapers never read a half written file
+
+
+class MetricsDumper(threading.Thread):
+    """
+    rewrites the prometheus dump file every interval, for node exporter's textfile collector or anything like it
+    """
+    def __init__(self, metrics: Metrics, path: str, interval: float=DUMP_INTERVAL):
+        super().__init__(name="metrics-dumper", daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics.dump(self.path)
+
+    def stop(self):
+        self.stopped.set()
+        self.metrics.dump(self.path)
+
+
+recorder = Metrics(enabled=os.environ.get('TAPIS_CLI_METRICS', '1') != '0') # one per process, shared by the server and every wrapper
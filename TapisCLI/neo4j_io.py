@@ -0,0 +1,228 @@
+import re
+import csv
+import json
+import time
+import typing
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from py2neo import Node, Relationship, Path
+from py2neo.client import Connection
+from py2neo.cypher import Record
+from py2neo.integration import Table
+from py2neo.errors import TransientError
+try:
+    from . import exceptions
+except:
+    import exceptions
+
+
+PAGE_SIZE = 500 # records pulled from the pod per round trip
+BATCH_SIZE = 5000 # rows sent to the pod per UNWIND transaction
+RETRIES = 3 # attempts per batch when the pod reports a transient failure such as a deadlock
+STRING_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`")
+WRITE_CLAUSES = re.compile(r'\b(CREATE|MERGE|SET|DELETE|REMOVE|DROP|LOAD\s+CSV|CALL)\b', re.IGNORECASE) # CALL since procedures may write
+
+
+def record_pages(graph, cypher: str, parameters: dict | None=None, page_size: int=PAGE_SIZE,
+                 cancelled=None) -> typing.Iterator[list[Record]]:
+    """
+    run a query in its own transaction and yield its records a page at a time. The next page is only pulled from the
+    pod once the previous one has been handled, so memory holds one page however large the result is. A cancel
+    between pages rolls the transaction back
+    """
+    connector = graph.service.connector
+    hydrant = Connection.default_hydrant(connector.profile, graph)
+    tx = graph.begin()
+    try:
+        result = connector.run(tx.ref, cypher, parameters or {})
+        flow_control = True
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise exceptions.Cancelled("query cancelled")
+            try:
+                connector.pull(result, n=page_size if flow_control else -1)
+            except IndexError: # bolt 3 pods have no flow control, the whole result arrives in one pull
+                flow_control = False
+                connector.pull(result, n=-1)
+            fields, page = result.fields(), list()
+            while (values := result.take()) is not None:
+                page.append(Record(fields, hydrant.hydrate_list(values)))
+            if page:
+                yield page
+            if not flow_control or not result.has_more_records():
+                break
+    except BaseException: # includes the consumer walking away from the generator
+        graph.rollback(tx)
+        raise
+    graph.commit(tx)
+
+
+def outside_literals(cypher: str) -> list[str]:
+    return STRING_LITERALS.split(cypher)
+
+
+def normalize(cypher: str) -> str:
+    """
+    the query with runs of whitespace outside string literals collapsed and any trailing semicolon dropped, so
+    reformatting a query does not miss the cache
+    """
+    literals = STRING_LITERALS.findall(cypher)
+    parts = [re.sub(r'\s+', ' ', part) for part in outside_literals(cypher)]
+    text = ''.join(part + literal for part, literal in zip(parts, literals + ['']))
+    return text.strip().rstrip(';').strip()
+
+
+def is_write(cypher: str) -> bool:
+    return any(WRITE_CLAUSES.search(part) for part in outside_literals(cypher))
+
+
+def query_key(pod_id: str, cypher: str, parameters: dict | None=None) -> tuple:
+    return (pod_id, normalize(cypher), json.dumps(parameters or {}, sort_keys=True, default=str))
+
+
+def render(page: list[Record]) -> str:
+    return repr(Table(page, keys=page[0].keys()))
+
+
+def plain(value):
+    """
+    graph values as json friendly structures
+    """
+    if isinstance(value, Node):
+        return {'id':value.identity, 'labels':sorted(value.labels), 'properties':dict(value)}
+    if isinstance(value, Relationship):
+        return {'id':value.identity, 'type':type(value).__name__, 'start':value.start_node.identity,
+                'end':value.end_node.identity, 'properties':dict(value)}
+    if isinstance(value, Path):
+        return {'nodes':[plain(node) for node in value.nodes], 'relationships':[plain(edge) for edge in value.relationships]}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key:plain(item) for key, item in value.items()}
+    return value
+
+
+def csv_cell(value):
+    value = plain(value)
+    return json.dumps(value, default=str) if isinstance(value, (list, dict)) else value
+
+
+def export_format(destination: str) -> str:
+    extension = destination.rsplit('.', 1)[-1].lower()
+    if extension == 'csv':
+        return 'csv'
+    if extension in ('ndjson', 'jsonl', 'json'):
+        return 'ndjson'
+    raise ValueError(f"Cannot export to {destination}, use a .csv or .ndjson file")
+
+
+def export_records(pages: typing.Iterable[list[Record]], destination: str, report: typing.Callable | None=None,
+                   interval: float=1.0) -> int:
+    """
+    write records to a csv or ndjson file page by page as they come off the pod. Returns how many were written
+    """
+    format = export_format(destination)
+    written, last_report = 0, time.time()
+    with open(destination, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f) if format == 'csv' else None
+        for page in pages:
+            if writer:
+                if not written:
+                    writer.writerow(page[0].keys())
+                writer.writerows([csv_cell(value) for value in record.values()] for record in page)
+            else:
+                f.writelines(json.dumps({key:plain(value) for key, value in record.items()}, default=str) + '\n'
+                             for record in page)
+            written += len(page)
+            if report and time.time() - last_report >= interval:
+                last_report = time.time()
+                report(f"exported {written} records to {destination}")
+    return written
+
+
+def read_rows(path: str) -> typing.Iterator[dict]:
+    """
+    rows of a .csv file as dicts keyed by its header, or the objects on the lines of a .ndjson file, read lazily
+    """
+    if export_format(path) == 'csv':
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batches(rows: typing.Iterable[dict], size: int) -> typing.Iterator[list[dict]]:
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def unwind_query(expression: str) -> str:
+    """
+    the per row cypher, which refers to the row as 'row', applied to a whole batch in one statement
+    """
+    return f"UNWIND $rows AS row\n{expression}"
+
+
+def write_batch(graph, cypher: str, rows: list[dict], retries: int=RETRIES, backoff: float=0.5):
+    for attempt in range(1, retries + 1):
+        tx = graph.begin()
+        try:
+            tx.run(cypher, rows=rows)
+        except TransientError: # parallel writers merging the same nodes can deadlock, the pod asks for a retry
+            graph.rollback(tx)
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** (attempt - 1))
+            continue
+        except BaseException:
+            graph.rollback(tx)
+            raise
+        graph.commit(tx)
+        return
+
+
+def bulk_import(run_batch: typing.Callable[[list[dict]], typing.Any], path: str, batch_size: int=BATCH_SIZE,
+                parallel: int=1, report: typing.Callable | None=None, interval: float=1.0,
+                cancelled=None) -> tuple[int, int, float]:
+    """
+    feed the rows of a file to run_batch a batch at a time on parallel writer threads. Only a couple of batches per
+    writer are read ahead, so the file is never loaded whole. Stops at the first batch that fails for good, or before
+    the next batch once cancelled. Returns the rows and batches committed and the seconds taken
+    """
+    start = last_report = time.time()
+    rows_done, batches_done = 0, 0
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="neo4j-writer") as pool:
+        in_flight = dict()
+        try:
+            for batch in batches(read_rows(path), batch_size):
+                if cancelled is not None and cancelled.is_set():
+                    raise exceptions.Cancelled()
+                if len(in_flight) >= parallel * 2:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                        rows_done += in_flight.pop(future)
+                        batches_done += 1
+                in_flight[pool.submit(run_batch, batch)] = len(batch)
+                if report and time.time() - last_report >= interval:
+                    last_report = time.time()
+                    report(f"imported {rows_done} rows at {rows_done / (last_report - start):.0f} rows/s")
+            for future in list(in_flight):
+                future.result()
+                rows_done += in_flight.pop(future)
+                batches_done += 1
+        except BaseException as e:
+            for future in in_flight: # batches not started yet never will be
+                future.cancel()
+            wait(in_flight) # the ones already writing finish, so the count below is what the pod really holds
+            committed = [future for future in in_flight if not future.cancelled() and not future.exception()]
+            rows_done += sum(in_flight[future] for future in committed)
+            batches_done += len(committed)
+            if isinstance(e, exceptions.Cancelled):
+                raise exceptions.Cancelled(f"import cancelled after {rows_done} rows in {batches_done} batches") from e
+            raise RuntimeError(f"import stopped after {rows_done} rows in {batches_done} batches: {e}") from e
+    return rows_done, batches_done, time.time() - start
@@ -0,0 +1,120 @@
+import time
+import typing
+import threading
+from py2neo import Graph
+from py2neo.errors import ClientError, ConnectionUnavailable
+
+
+class PodGraph:
+    """
+    a long lived Graph for one pod, with the credentials it was opened with and its latency numbers
+    """
+    def __init__(self, graph: Graph, credentials: tuple[str, str], connect_time: float):
+        self.graph = graph
+        self.credentials = credentials
+        self.connect_time = connect_time
+        self.last_used = time.monotonic()
+        self.queries = 0
+        self.first_query_time = None
+        self.warm_query_time = 0.0 # total for every query after the first
+
+    def record(self, elapsed: float):
+        self.last_used = time.monotonic()
+        if self.first_query_time is None:
+            self.first_query_time = elapsed
+        else:
+            self.warm_query_time += elapsed
+        self.queries += 1
+
+    def close(self):
+        try:
+            self.graph.service.connector.close()
+        except Exception:
+            pass
+
+
+class GraphPool:
+    """
+    one Graph per pod, each holding up to max_size open bolt connections. Once a pod's graph exists its queries skip
+    the credential lookups and the TLS handshake. Credentials are fetched again only when the pod rejects them, and
+    graphs left unused for idle_timeout seconds are closed
+    """
+    def __init__(self, t, max_size: int=4, idle_timeout: float=600):
+        self.t = t
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.graphs = dict() # pod id -> PodGraph
+        self.lock = threading.Lock()
+
+    def credentials(self, pod_id: str) -> tuple[str, str]:
+        credentials = self.t.pods.get_pod_credentials(pod_id=pod_id) # one lookup for both the username and password
+        return credentials.user_username, credentials.user_password
+
+    def open(self, pod_id: str) -> PodGraph:
+        start = time.perf_counter()
+        credentials = self.credentials(pod_id)
+        graph = Graph(f"bolt+ssc://{pod_id}.pods.icicle.tapis.io:443", auth=credentials, secure=True, verify=True,
+                      max_size=self.max_size)
+        return PodGraph(graph, credentials, time.perf_counter() - start)
+
+    def get(self, pod_id: str) -> PodGraph:
+        self.evict_idle()
+        with self.lock:
+            pod_graph = self.graphs.get(pod_id)
+        if pod_graph is None:
+            pod_graph = self.open(pod_id) # connect outside the lock so other pods are not held up
+            with self.lock:
+                pod_graph = self.graphs.setdefault(pod_id, pod_graph)
+        return pod_graph
+
+    def discard(self, pod_id: str):
+        with self.lock:
+            pod_graph = self.graphs.pop(pod_id, None)
+        if pod_graph:
+            pod_graph.close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            idle = [pod_id for pod_id, pod_graph in self.graphs.items() if now - pod_graph.last_used > self.idle_timeout]
+            evicted = [self.graphs.pop(pod_id) for pod_id in idle]
+        for pod_graph in evicted:
+            pod_graph.close()
+
+    def run(self, pod_id: str, operation: typing.Callable[[Graph], typing.Any],
+            retryable: typing.Callable[[], bool] | None=None):
+        """
+        run operation(graph) against the pod. If the pod rejects the cached credentials or drops the connection, the
+        graph is dropped so the next use reconnects with fresh credentials. The operation itself is only tried once
+        more if retryable, asked after the failure, says running it again is safe: a read that has not sent anything
+        to the CLI yet. Writes and half streamed results raise instead of running twice
+        """
+        for attempt in range(2):
+            pod_graph = self.get(pod_id)
+            start = time.perf_counter()
+            try:
+                result = operation(pod_graph.graph)
+            except (ClientError, ConnectionUnavailable) as e:
+                if isinstance(e, ClientError) and 'Security' not in str(e.code):
+                    raise
+                self.discard(pod_id)
+                if attempt or retryable is None or not retryable():
+                    raise
+                continue
+            pod_graph.record(time.perf_counter() - start)
+            return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {pod_id:{'connect_seconds':round(pod_graph.connect_time, 4),
+                            'queries':pod_graph.queries,
+                            'first_query_seconds':round(pod_graph.first_query_time or 0, 4),
+                            'warm_query_seconds':round(pod_graph.warm_query_time / (pod_graph.queries - 1), 4)
+                                                 if pod_graph.queries > 1 else None}
+                    for pod_id, pod_graph in self.graphs.items()}
+
+    def close(self):
+        with self.lock:
+            pod_graphs, self.graphs = list(self.graphs.values()), dict()
+        for pod_graph in pod_graphs:
+            pod_graph.close()
@@ -7,12 +7,15 @@ class CommandData(BaseModel):
     kwargs: Optional[dict]
     expression: Optional[str] 
     exit_status: int = 0
+    request_id: Optional[int] # ties requests, replies and responses to the command they belong to
+    cwd: Optional[str] # the directory the command was given in, relative local paths are resolved against it
 
 
 class AuthData(BaseModel):
     schema_type: str = 'AuthData'
     username: Optional[str]
     password: Optional[str]
+    request_id: Optional[int]
 
 
 class StartupData(BaseModel):
@@ -20,29 +23,48 @@ class StartupData(BaseModel):
     initial: bool = False
     username: Optional[str]
     url: Optional[str]
+    codecs: Optional[list] # codecs the server can decode, in order of preference
+    codec: Optional[str] # codec the client picked from that list
+    max_in_flight: Optional[int] # commands the server runs at once for this CLI, more than that queue
 
 
 class ResponseData(BaseModel):
     schema_type: str = 'ResponseData'
     response_message: Any
     exit_status: int = 0
+    request_id: Optional[int]
 
 
 class FormRequest(BaseModel):
     schema_type: str = 'FormRequest'
     arguments_list: list
+    request_id: Optional[int]
 
 
 class FormResponse(BaseModel):
     schema_type: str = 'FormResponse'
     arguments_list: dict | str
+    request_id: Optional[int]
 
 
 class AuthRequest(BaseModel):
     schema_type: str = 'AuthRequest'
     secure_input: bool = False
+    request_id: Optional[int]
 
 
 class ConfirmationRequest(BaseModel):
     schema_type: str = 'ConfirmationRequest'
     message: str
+    request_id: Optional[int]
+
+
+class StreamData(BaseModel):
+    schema_type: str = 'StreamData' # output a command sends before its final ResponseData, like progress or partial results
+    message: Any
+    request_id: Optional[int]
+
+
+class CancelData(BaseModel):
+    schema_type: str = 'CancelData' # asks the server to stop the command with this request id
+    request_id: Optional[int]
@@ -0,0 +1,97 @@
+import json
+try:
+    import msgpack # optional. Without it the client and server fall back to json
+except ImportError:
+    msgpack = None
+
+
+class JSONCodec:
+    """
+    text encoding, always available. Used for the handshake and whenever the other side offers nothing better
+    """
+    name = 'json'
+    codec_id = 0
+
+    @staticmethod
+    def encode(data) -> bytes:
+        return json.dumps(data).encode('utf-8')
+
+    @staticmethod
+    def decode(payload: bytes | bytearray):
+        return json.loads(payload)
+
+
+class MsgpackCodec:
+    """
+    compact binary encoding of the same dict structures produced by the schemas
+    """
+    name = 'msgpack'
+    codec_id = 1
+
+    @staticmethod
+    def encode(data) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    @staticmethod
+    def decode(payload: bytes | bytearray):
+        return msgpack.unpackb(payload, raw=False)
+
+
+# codecs in order of preference. Only the ones whose libraries are installed are offered in the handshake
+codec_preference: list = [MsgpackCodec, JSONCodec]
+available_codecs: list = [codec for codec in codec_preference if codec is JSONCodec or msgpack]
+codecs_by_name: dict = {codec.name:codec for codec in available_codecs}
+codecs_by_id: dict = {codec.codec_id:codec for codec in available_codecs}
+
+
+def offered_codecs() -> list[str]:
+    return [codec.name for codec in available_codecs]
+
+
+def negotiate(offered: list[str] | None):
+    """
+    pick the first codec from the other side's preference list that this side also supports
+    """
+    for name in offered or []:
+        if name in codecs_by_name:
+            return codecs_by_name[name]
+    return JSONCodec
+
+
+def get_codec(name: str | None):
+    return codecs_by_name.get(name, JSONCodec)
+
+
+if __name__ == "__main__":
+    # codec benchmark. Encodes and decodes a representative message of every schema type with every available
+    # codec and reports the cost per round trip and the bytes that would go on the wire
+    import timeit
+    try:
+        from . import SocketOpts as SO
+        from . import schemas
+    except:
+        import SocketOpts as SO
+        import schemas
+
+    listing = [{'name':f'file_{index}.out', 'group':'G-819', 'path':f'/scratch/run_{index // 100}/file_{index}.out',
+                'size':index * 4096, 'nativePermissions':'rw-r--r--', 'lastModified':'2023-07-11T19:42:18Z'}
+               for index in range(20000)]
+    samples = {
+        'CommandData':schemas.CommandData(kwargs={'command_group':'files', 'command':'list_files', 'id':'frontera', 'file':'/scratch', 'verbose':True}),
+        'AuthData':schemas.AuthData(username='user', password='password'),
+        'StartupData':schemas.StartupData(initial=True, username='user', url='https://icicle.tapis.io/v3', codecs=offered_codecs()),
+        'ResponseData':schemas.ResponseData(response_message=listing),
+        'FormRequest':schemas.FormRequest(arguments_list=['id', 'version', 'description']),
+        'FormResponse':schemas.FormResponse(arguments_list={'id':'app', 'version':'0.1', 'description':'test app'}),
+        'AuthRequest':schemas.AuthRequest(secure_input=True),
+        'ConfirmationRequest':schemas.ConfirmationRequest(message="You requested to delete_pod. Please confirm (y/n)")
+    }
+    for schema_name, sample in samples.items():
+        data = sample.dict()
+        repeats = 5 if schema_name == 'ResponseData' else 2000
+        for codec in available_codecs:
+            payload = codec.encode(data)
+            encode_time = timeit.timeit(lambda: codec.encode(data), number=repeats) / repeats
+            decode_time = timeit.timeit(lambda: getattr(schemas, schema_name)(**codec.decode(payload)), number=repeats) / repeats
+            print(f"{schema_name:<20}{codec.name:<9}{len(payload) + SO.HEADER.size:>10} bytes  "
+                  f"encode {encode_time * 1e6:>10.1f} us  decode {decode_time * 1e6:>10.1f} us")
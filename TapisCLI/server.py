@@ -1,17 +1,18 @@
-import pyfiglet
 import argparse
 import sys
 from getpass import getpass
 import time
-import re
 from tapipy.tapis import Tapis
 import tapipy.tapis
 import socket
 import json
 import threading
+import itertools
 import multiprocessing
 import os
 import logging
+from collections import OrderedDict
+from functools import partial
 from tapisObjectWrappers import Files, Apps, Pods, Systems, Neo4jCLI
 from TypeEnforcement.type_enforcer import TypeEnforcer
 import typing
@@ -22,31 +23,44 @@ try:
     from . import helpers
     from . import schemas
     from . import decorators
+    from . import serializers
+    from . import sessions
+    from . import token_store
+    from . import daemon
+    from . import metrics
 except:
     import exceptions
     import SocketOpts as SO
     import helpers
     import schemas
     import decorators
+    import serializers
+    import sessions
+    import token_store
+    import daemon
+    import metrics
 
-class Server(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup, helpers.DynamicHelpUtility):
+helpers.load(schemas)  # lazy for the CLI's sake, but every session thread builds models with it
+
+class Server(helpers.OperationsHelper, decorators.DecoratorSetup, helpers.DynamicHelpUtility):
     @TypeEnforcer.enforcer(recursive=True)
-    def __init__(self, IP: str, PORT: int):
+    def __init__(self, IP: str, PORT: int, max_tenants: int=4, transport: str | None=None):
+        self.started = time.perf_counter()
         # logger setup
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
         stream_handler = logging.StreamHandler(stream=sys.stdout)
 
         file_handler = logging.FileHandler(
-            r'logs.log', mode='w')
+            daemon.log_path(PORT), mode='w') # under ~/.tapis-cli, not wherever the server was started from
         stream_handler.setLevel(logging.INFO)
         file_handler.setLevel(logging.INFO)
 
         # set formats
         stream_format = logging.Formatter(
-            '%(name)s - %(levelname)s - %(message)s')
+            '%(name)s - %(threadName)s - %(levelname)s - %(message)s')
         file_format = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            '%(asctime)s - %(name)s - %(threadName)s - %(levelname)s - %(message)s')
 
         stream_handler.setFormatter(stream_format)
         file_handler.setFormatter(file_format)
@@ -59,45 +73,47 @@ class Server(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup,
 
         # setting up socket server
         self.ip, self.port = IP, PORT
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind((self.ip, self.port))
-        self.sock.listen(1)
-        self.connection = None  # initialize the connection variable
-        self.end_time = time.time() + 300  # start the countdown on the timeout
-
-        self.logger.info("Awaiting connection")
-
-        self.pods = None
-        self.systems = None
-        self.files = None
-        self.apps = None
-        self.neo4j = None
-        self.t = None
-        self.url = None
-        self.access_token = None
-        self.username = None
-        self.password = None
-
-        self.accept(initial=True)  # connection returns the tapis object and user info
-
-        # instantiate the subsystems
-        self.logger.info('initialization complete')
+        self.transport = transport or SO.transport()
+        self.sock = SO.listen(self.ip, self.port, self.transport)
+        self.session_ids = itertools.count(1)  # unix socket peers have no port to name their session by
+
+        self.sessions = set()  # every connected session, each one served on its own thread
+        self.sessions_lock = threading.Lock()
+        self.tenants = OrderedDict()  # (base url, username) -> sessions.Login, least recently used first
+        self.tenants_lock = threading.Lock()
+        self.max_tenants = max_tenants
+        self.warm_login = None  # most recently used login. New connections adopt it
+
+        # the group map holds the wrapper classes for help generation. Sessions map the groups to their own instances
         self.command_group_map = {
-            'pods':self.pods,
-            'systems':self.systems,
-            'files':self.files,
-            'apps':self.apps
+            'pods':Pods,
+            'systems':Systems,
+            'files':Files,
+            'apps':Apps,
+            'neo4j':Neo4jCLI
         }
         self.command_map = {
             'help':self.help,
-            'whoami':self.pods.whoami,
+            'whoami':self.whoami,
             'exit':self.__exit,
             'shutdown':self.__shutdown,
-            'switch_service':self.tapis_init
+            'switch_service':self.tapis_init,
+            'cache_stats':self.cache_stats,
+            'stats':self.stats
         }
-        help0, help1 = self.help_generation()
-        self.help = dict(help0, **help1)
+        self.registry = self.command_registry()
+        self.help = self.registry['help']
+
+        self.tokens = token_store.TokenStore()
+        self.restore_login()
+        self.refresher = token_store.TokenRefresher(self.tokens, self.held_logins, logger=self.logger)
+        self.refresher.start()
+        self.metrics_dumper = None
+        if os.environ.get('TAPIS_CLI_METRICS_FILE'):  # keep a prometheus text file current for an external scraper
+            self.metrics_dumper = metrics.MetricsDumper(metrics.recorder, os.environ['TAPIS_CLI_METRICS_FILE'])
+            self.metrics_dumper.start()
+
+        self.logger.info("Awaiting connection")
 
     @decorators.Auth
     def tapis_init(self, username: str, password: str, name: str) -> tuple[typing.Any, str, str] | None:  # name is the baseURL
@@ -105,60 +121,93 @@ class Server(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup,
         @help: switch the connected tapis service
         """
         start = time.time()
-        self.username = username
-        self.password = password
-        t = Tapis(base_url=name,
-                  username=username,
-                  password=password)
-        t.get_tokens()
-
-        self.configure_decorators()
-        # V3 Headers
-        header_dat = {"X-Tapis-token": t.access_token.access_token,
-                      "Content-Type": "application/json"}
-
-        # Service URL
-        url = f"{name}/v3"
-
-        # create authenticator for tapis systems
-        authenticator = t.access_token
-        # extract the access token from the authenticator
-        access_token = re.findall(
-            r'(?<=access_token: )(.*)', str(authenticator))[0]
-
-        self.pods = Pods(t, username, password, self.connection)
-        self.systems = Systems(t, username, password, self.connection)
-        self.files = Files(t, username, password, self.connection)
-        self.apps = Apps(t, username, password, self.connection)
-        self.neo4j = Neo4jCLI(t, username, password, self.connection)
-
-        self.t = t
-        self.url = url
-        self.access_token = access_token
+        login = self.pooled_login(name, username, password)
+        if login is None:
+            known = self.tokens.get(name, username) or dict()  # a known tenant spares tapipy its tenants lookup
+            t = Tapis(base_url=name,
+                      username=username,
+                      password=password,
+                      tenant_id=known.get('tenant_id'),
+                      **token_store.client_credentials())
+            t.get_tokens()
+            self.tokens.save(t)  # the next server start can pick this login up without a password
+            login = self.remember(t, username, password)
+        self.warm_login = login
+        self.session.adopt(login)
 
         self.logger.info(f"initiated in {time.time()-start}")
 
-        return f"Successfully initialized tapis service on {self.url}"
+        return f"Successfully initialized tapis service on {login.url}"
 
-    @TypeEnforcer.enforcer(recursive=True)
-    def accept(self, initial: bool=False):  # function to accept CLI connection to the server
-        self.connection, ip_port = self.sock.accept()  # connection request is accepted
-        self.logger.info("Received connection request")
+    def pooled_login(self, base_url: str, username: str, password: str) -> sessions.Login | None:
+        """
+        a login to the tenant that is still held, provided the password matches the one it was made with
+        """
+        with self.tenants_lock:
+            login = self.tenants.get((base_url, username))
+            if login is None or not login.check_password(password):
+                return None
+            self.tenants.move_to_end((base_url, username))
+            return login
+
+    def remember(self, t: Tapis, username: str, password: str | None) -> sessions.Login:
+        """
+        keep a logged in client in the pool of recent tenants, letting go of the least recently used one when the
+        pool is full. Its service wrappers are only built when their command group is first used
+        """
+        factories = {group:partial(wrapper, t, username, password, None) for group, wrapper in self.command_group_map.items()}
+        login = sessions.Login(t, username, password, factories)
+        with self.tenants_lock:
+            previous = self.tenants.pop((t.base_url, username), None)
+            self.tenants[(t.base_url, username)] = login
+            evicted = [self.tenants.popitem(last=False)[1] for _ in range(len(self.tenants) - self.max_tenants)]
+        for old_login in filter(None, [previous, *evicted]):
+            old_login.close()  # sessions still working under it reopen connections as they need them
+        self.warm_login = login
+        return login
+
+    def restore_login(self):
+        """
+        log in from the token store, so the first CLI after a restart skips the password exchange. This costs no
+        network call while the stored access token is valid and one refresh call when it is not
+        """
+        entry = self.tokens.latest()
+        if entry is None:
+            return
+        start = time.time()
+        try:
+            t = token_store.restore(entry)
+            if token_store.renew(t):
+                self.tokens.save(t)
+        except Exception as e:
+            self.logger.warning(f"Stored tokens are not usable, waiting for a login: {e}")
+            return
+        self.remember(t, entry['username'], None)
+        self.logger.info(f"restored the login of {entry['username']} on {entry['base_url']} in {time.time()-start}")
+
+    def held_logins(self) -> list:
+        with self.tenants_lock:
+            return [(login.t, login.password) for login in self.tenants.values()]
+
+    def accept(self, session: sessions.Session):  # run the startup handshake with a newly connected CLI
+        session.configure_decorators()  # everything run on this thread talks to this session
+        initial = self.warm_login is None  # nobody has logged in yet, so this CLI has to
+        startup_data = schemas.StartupData(initial = initial, codecs = serializers.offered_codecs())
+        session.json_send(startup_data.dict())
+        self.logger.info("send the initial status update")
 
         if initial:  # if this is the first time in the session that the cli is connecting
-            startup_data = schemas.StartupData(initial = initial)
-            self.json_send(startup_data.dict())
-            self.logger.info("send the initial status update")
-
             # give the cli 3 attempts to provide authentication
             for attempt in range(1, 4):
                   # receive the username and password
-                url: schemas.StartupData = self.schema_unpack().url
+                startup_reply: schemas.StartupData = session.schema_unpack()
+                url = startup_reply.url
+                session.codec = serializers.get_codec(startup_reply.codec)
                 try:
                 # try intializing tapis with the supplied credentials
                     auth_request = schemas.AuthRequest()
-                    self.json_send(auth_request.dict())
-                    auth_data: schemas.AuthData = self.schema_unpack()
+                    session.json_send(auth_request.dict())
+                    auth_data: schemas.AuthData = session.schema_unpack()
                     username, password = auth_data.username, auth_data.password
 
                     self.tapis_init(name=url, username=username, password=password)
@@ -169,18 +218,21 @@ class Server(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup,
                     print(e)
                     # send failure message to CLI
                     login_failure_data = schemas.ResponseData(response_message = (str(e), attempt))
-                    self.json_send(login_failure_data.dict())
+                    session.json_send(login_failure_data.dict())
                     self.logger.warning("Verification failure")
                     if attempt == 3:  # If there have been 3 login attempts
                         self.logger.error(
-                            "Attempted verification too many times. Exiting")
-                        os._exit(0)  # shutdown the server
+                            "Attempted verification too many times. Closing the connection")
+                        raise exceptions.Exit
                     continue
         else:
-            self.configure_decorators()
-        startup_result = schemas.StartupData(initial = initial, username = self.username, url = self.url)
+            session.codec = serializers.get_codec(session.schema_unpack().codec)
+            session.adopt(self.warm_login)
+        self.logger.info(f"Using the {session.codec.name} codec")
+        startup_result = schemas.StartupData(initial = initial, username = session.username, url = session.url,
+                                             max_in_flight = session.max_in_flight)
         self.logger.info("Connection success")
-        self.json_send(startup_result.dict())
+        session.json_send(startup_result.dict())
         self.logger.info("Final connection data sent")
 
     def __exit(self):
@@ -196,8 +248,29 @@ class Server(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup,
         self.logger.info("Shutdown initiated")
         raise exceptions.Shutdown
 
-    def timeout_handler(self):  # handle timeouts
-        if time.time() > self.end_time:  # if the time exceeds the timeout time
+    def whoami(self, verbose: bool, fresh: bool) -> str:
+        """
+        @help: returns the username of the current user
+        """
+        return self.session.command_group_map['pods'](command='whoami', verbose=verbose, fresh=fresh)
+
+    def cache_stats(self) -> dict:
+        """
+        @help: show hit and miss counts for the cached read only commands of each service and the cached neo4j queries
+        """
+        return {group:wrapper.cache.stats() for group, wrapper in self.session.command_group_map.built.items()
+                if wrapper.cache_ttls or getattr(wrapper, 'query_ttl', None)}
+
+    def stats(self, output: str) -> str:
+        """
+        @help: show the count, errors, latency, socket bytes and tapis calls of every command run since the server started. With -o, also write them to a file in the prometheus text format
+        """
+        if output:
+            metrics.recorder.dump(self.local_path(output))
+        return json.dumps(metrics.recorder.snapshot(), indent=1)
+
+    def timeout_handler(self, session: sessions.Session):  # handle timeouts
+        if time.time() > session.end_time:  # if the time exceeds the timeout time
             raise exceptions.TimeoutError
     
     def format_help(self, command: dict):
@@ -216,47 +289,127 @@ class Server(SO.SocketOpts, helpers.OperationsHelper, decorators.DecoratorSetup,
 
     def run_command(self, command_data: dict):  # process and run commands
         command_group = command_data['command_group']
-        if command_group in self.command_group_map:
-            command_group = self.command_group_map[command_group]
+        command_group_map = self.session.command_group_map
+        if command_group in command_group_map:
+            command_group = command_group_map[command_group]
             return command_group(**command_data)
         elif command_group in self.command_map:
             command = self.command_map[command_group]
-            command_data = self.filter_kwargs(command, command_data)
-            if command_data:
-                return command(**command_data)
-            return command()
+            command_data = self.filter_kwargs(command, command_data, self.registry['parameters'][command_group])
+            with metrics.recorder.measure(command_group):
+                if command_data:
+                    return command(**command_data)
+                return command()
         else:
             raise exceptions.CommandNotFoundError(command_group)
 
-    def main(self):
-        while True: 
+    def execute(self, session: sessions.Session, message: schemas.CommandData, cancelled: threading.Event,
+                received: int=0):  # run one command on a session worker
+        session.configure_decorators(message.request_id, cancelled, message.cwd)  # decorators on this thread answer to this command
+        ending = None  # 'exit' or 'shutdown' once the one response to this request is out
+        with metrics.recorder.scope(received):  # the command's request, response and everything in between
             try:
-                message = self.schema_unpack()  
-                self.timeout_handler()  
-                kwargs, exit_status = message.kwargs, message.exit_status
-                result = self.run_command(kwargs)
-                response = schemas.ResponseData(response_message = result)
-                self.end_time = time.time() + 300 
-                self.json_send(response.dict()) 
+                session.check_cancelled()  # cancelled while it was still queued
+                result = self.run_command(message.kwargs)
+                response = schemas.ResponseData(response_message = result, request_id = message.request_id)
                 print(message)
-                if exit_status == 1:
-                    self.__exit()
+                if message.exit_status == 1:  # a one shot CLI quits once it has its answer
+                    ending = 'exit'
+            except exceptions.Cancelled as e:
+                self.logger.info(f"request {message.request_id} cancelled")
+                response = schemas.ResponseData(response_message = f"[-] {e}", request_id = message.request_id)
             except (exceptions.CommandNotFoundError, exceptions.NoConfirmationError, exceptions.InvalidCredentialsReceived) as e:
-                error_response = schemas.ResponseData(response_message = str(e))
-                self.json_send(error_response.dict())
-            except (exceptions.TimeoutError, exceptions.Shutdown) as e:
-                error_response = schemas.ResponseData(response_message = str(e), exit_status=1)
-                self.json_send(error_response.dict())
-                sys.exit(0)
+                response = schemas.ResponseData(response_message = str(e), request_id = message.request_id)
+            except exceptions.Shutdown as e:
+                response = schemas.ResponseData(response_message = str(e), exit_status=1, request_id = message.request_id)
+                ending = 'shutdown'
             except exceptions.Exit as e:
                 self.logger.info("user exit initiated")
-                error_response = schemas.ResponseData(response_message = str(e), exit_status=1)
-                self.json_send(error_response.dict())
-                self.connection.close()  # close the connection
-                self.accept()  # wait for CLI to reconnect
+                response = schemas.ResponseData(response_message = str(e), exit_status=1, request_id = message.request_id)
+                ending = 'exit'
+            except (ConnectionError, OSError):  # the CLI went away while the command ran, nobody is left to answer
+                self.logger.info("connection dropped during a command")
+                response = None
+            except Exception as e:  # anything else still has to be answered, or the CLI waits on this request forever
+                self.logger.exception(e)
+                response = schemas.ResponseData(response_message = str(e), request_id = message.request_id)
+            try:
+                if response is not None:
+                    session.json_send(response.dict())  # exactly one response per request id
+            except (ConnectionError, OSError):
+                self.logger.info("connection dropped before the response was sent")
+            finally:
+                session.finish(message.request_id)
+                if ending == 'shutdown':
+                    self.shutdown()
+                elif ending == 'exit':
+                    session.close()  # the session thread sees the closed socket and cleans up
+
+    def serve(self, session: sessions.Session):  # handle one CLI for as long as it stays connected
+        self.logger.info(f"Received connection request from {session.address}")
+        with self.sessions_lock:
+            self.sessions.add(session)
+        try:
+            self.accept(session)
+            session.take_received()  # the handshake is not any command's traffic
+            session.multiplexed = True  # from here on this thread only reads, commands run on the session workers
+            while True: 
+                message = session.schema_unpack()
+                received = session.take_received()
+                if message.schema_type == 'CancelData':  # Ctrl-C in the CLI
+                    if session.cancel(message.request_id):
+                        self.logger.info(f"cancelling request {message.request_id}")
+                    continue
+                if message.schema_type != 'CommandData':  # a reply to a form, auth or confirmation request
+                    if not session.deliver(message):
+                        self.logger.warning(f"Received a {message.schema_type} for unknown request {message.request_id}")
+                    continue
+                try:
+                    self.timeout_handler(session)  
+                except exceptions.TimeoutError as e:
+                    self.logger.info("session timed out")
+                    error_response = schemas.ResponseData(response_message = str(e), exit_status=1, request_id = message.request_id)
+                    session.json_send(error_response.dict())
+                    break
+                session.end_time = time.time() + 300 
+                session.workers.submit(self.execute, session, message, session.track(message.request_id), received)
+        except exceptions.ProtocolError as e:  # not a CLI, or one from before framing
+            self.logger.warning(f"{session.address}: {e}")
+        except (exceptions.Exit, ConnectionError, OSError):  # failed logins and dropped connections only end this session
+            self.logger.info("connection dropped")
+        finally:
+            session.close()  # close the connection
+            with self.sessions_lock:
+                self.sessions.discard(session)
+            self.logger.info(f"{len(self.sessions)} sessions still connected")
+
+    def shutdown(self):
+        self.refresher.stop()
+        if self.metrics_dumper:
+            self.metrics_dumper.stop()
+        daemon.clear_state(self.port)
+        with self.sessions_lock:
+            for session in self.sessions:
+                session.close()
+        self.sock.close()
+        if self.transport == 'unix':
+            os.remove(SO.unix_path(self.port))
+        os._exit(0)  # take every other session thread down with the server
+
+    def main(self):
+        daemon.write_state(self.port) # tells a waiting client the server is ready
+        self.logger.info(f"Ready on {self.transport} port {self.port}, set up in {time.perf_counter() - self.started:.2f}s")
+        while True:  # accept CLIs for as long as the server runs. Each one gets its own session thread
+            connection, address = self.sock.accept()
+            session = sessions.Session(connection, address or self.transport)
+            threading.Thread(target=self.serve, args=(session,), name=f"session-{next(self.session_ids)}", daemon=True).start()
 
 
 
 if __name__ == '__main__':
-    server = Server('127.0.0.1', 30000)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=30000)
+    parser.add_argument('--transport', choices=SO.TRANSPORTS, default=None)
+    arguments = parser.parse_args()
+    server = Server('127.0.0.1', arguments.port, transport=arguments.transport)
     server.main()
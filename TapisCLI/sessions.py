@@ -0,0 +1,242 @@
+import os
+import time
+import queue
+import socket
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from tapipy import errors as tapis_errors
+try:
+    from . import SocketOpts as SO
+    from . import decorators
+    from . import schemas
+    from . import exceptions
+    from . import metrics
+except:
+    import SocketOpts as SO
+    import decorators
+    import schemas
+    import exceptions
+    import metrics
+
+
+MAX_IN_FLIGHT = int(os.environ.get('TAPIS_CLI_MAX_IN_FLIGHT', 8)) # commands one CLI can have running at once, the rest queue
+
+
+class LazyServices(Mapping):
+    """
+    command group -> service wrapper, each one built the first time its group is used
+    """
+    def __init__(self, factories: dict):
+        self.factories = factories
+        self.built = dict()
+        self.lock = threading.Lock()
+
+    def __getitem__(self, group: str):
+        wrapper = self.built.get(group)
+        if wrapper is None:
+            factory = self.factories[group]
+            with self.lock:
+                wrapper = self.built.get(group) or self.built.setdefault(group, factory())
+        return wrapper
+
+    def __contains__(self, group) -> bool:
+        return group in self.factories # without building it
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def __len__(self) -> int:
+        return len(self.factories)
+
+
+class Login:
+    """
+    one authenticated user on one tapis tenant: the client, the password once it is known and the service wrappers
+    built around the client. Sessions adopt a login rather than owning one, so any number of CLIs and the server's
+    pool of recent tenants share it
+    """
+    def __init__(self, t, username: str, password: str | None, factories: dict):
+        self.t = t
+        self.username = username
+        self.password = password  # unknown when the login was restored from stored tokens
+        self.url = f"{t.base_url}/v3"
+        self.services = LazyServices(factories)
+        metrics.recorder.instrument(t)  # counts the tapis calls each command makes
+
+    @property
+    def access_token(self) -> str:
+        return self.t.get_access_jwt()  # read every time, the refresher swaps the token underneath
+
+    def check_password(self, password: str) -> bool:
+        if self.password is not None:
+            return password == self.password
+        if not password:
+            return False
+        try:  # restored from stored tokens, so only tapis can tell. A good password also renews the tokens
+            self.t.get_tokens(username=self.username, password=password)
+        except tapis_errors.BaseTapyException:
+            return False
+        self.password = password  # now it can stand in when the refresh token runs out
+        return True
+
+    def close(self):
+        neo4j = self.services.built.get('neo4j')
+        if neo4j:
+            neo4j.graphs.close()  # the bolt connections held open to the tenant's pods
+        apps = self.services.built.get('apps')
+        if apps:
+            apps.watcher.stop()
+
+
+class Session(SO.SocketOpts, decorators.DecoratorSetup):
+    """
+    everything the server keeps for one connected CLI: the socket, the codec it negotiated, the credentials it
+    logged in with and the tapis client and service wrappers built for it. Each session is served on its own thread,
+    and the commands it sends run on the session's worker pool so several can be in flight at once
+    """
+    def __init__(self, connection, address, max_in_flight: int=MAX_IN_FLIGHT):
+        self.connection = connection
+        self.address = address
+        self.end_time = time.time() + 300  # start the countdown on the timeout
+
+        self.send_lock = threading.Lock()  # workers share the socket, whole frames must go out one at a time
+        self.pending = dict()  # request id -> queue the waiting command receives the CLI's reply on
+        self.pending_lock = threading.Lock()
+        self.cancellations = dict()  # request id -> event set when the CLI cancels that command
+        self.bytes_received = 0  # read off the socket since the session thread last took the count
+        self.multiplexed = False  # set once the handshake is over and the session thread only reads
+        self.max_in_flight = max_in_flight  # told to the CLI in the handshake, so batch does not ask for more
+        self.workers = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="command")
+
+        self.login = None  # the tapis login this CLI works under
+        self.username = None
+        self.url = None
+        self.t = None
+
+    @property
+    def command_group_map(self) -> LazyServices:
+        return self.login.services if self.login else LazyServices(dict())
+
+    def adopt(self, login: Login):
+        """
+        work under an existing tapis login instead of authenticating again. This is what lets several shells share
+        one warm server, and switching to a tenant that is still in the server's pool cost nothing
+        """
+        self.login = login
+        self.username, self.url, self.t = login.username, login.url, login.t
+
+    @property
+    def access_token(self) -> str | None:
+        return self.login.access_token if self.login else None
+
+    def check_password(self, password: str) -> bool:
+        return self.login is not None and self.login.check_password(password)
+
+    def json_send(self, data: dict | list | str):
+        with self.send_lock:
+            return super().json_send(data)
+
+    def frame_send_explicit(self, connection, payload: bytes, schema_code: int=SO.UNTYPED):
+        super().frame_send_explicit(connection, payload, schema_code)
+        metrics.recorder.sent(SO.HEADER.size + len(payload))  # booked against the command sending it
+
+    def receive_exactly(self, connection, size: int) -> bytearray:
+        buffer = super().receive_exactly(connection, size)
+        self.bytes_received += size
+        return buffer
+
+    def take_received(self) -> int:
+        received, self.bytes_received = self.bytes_received, 0
+        return received
+
+    def request(self, message):
+        """
+        send a form, auth or confirmation request for the command running on this thread and wait for the CLI's reply to it
+        """
+        message.request_id = self.request_id
+        if not self.multiplexed:  # still in the handshake, nothing else is reading the socket
+            self.json_send(message.dict())
+            return self.schema_unpack()
+        replies = queue.Queue()
+        with self.pending_lock:
+            self.pending[message.request_id] = replies
+        try:
+            self.json_send(message.dict())
+            reply = replies.get()
+        finally:
+            with self.pending_lock:
+                self.pending.pop(message.request_id, None)
+        if reply is None:
+            self.check_cancelled()  # woken by a cancel rather than a dropped connection
+            raise ConnectionError("[-] Connection was dropped")
+        return reply
+
+    def stream(self, message):
+        """
+        send output for the command running on this thread to the CLI before the command returns
+        """
+        stream_data = schemas.StreamData(message=message, request_id=self.request_id)
+        self.json_send(stream_data.dict())
+
+    def track(self, request_id: int) -> threading.Event:
+        """
+        the cancellation event for a command, registered before it is queued so a cancel can arrive before it starts
+        """
+        cancelled = threading.Event()
+        with self.pending_lock:
+            self.cancellations[request_id] = cancelled
+        return cancelled
+
+    def finish(self, request_id: int):
+        with self.pending_lock:
+            self.cancellations.pop(request_id, None)
+
+    def cancel(self, request_id: int) -> bool:
+        """
+        flag a command as cancelled. It stops at its next chunk, page or batch boundary, or at once if it is waiting
+        on a form. Returns False if no such command is running
+        """
+        with self.pending_lock:
+            cancelled = self.cancellations.get(request_id)
+            replies = self.pending.get(request_id)
+        if cancelled is None:
+            return False
+        cancelled.set()
+        if replies is not None:
+            replies.put(None)
+        return True
+
+    def notify(self, message):
+        """
+        push output that belongs to no command, like a watched job changing state, to the CLI
+        """
+        stream_data = schemas.StreamData(message=message)
+        self.json_send(stream_data.dict())
+
+    def deliver(self, message) -> bool:
+        """
+        hand a reply read off the socket to the command waiting on it
+        """
+        with self.pending_lock:
+            replies = self.pending.get(message.request_id)
+        if replies is None:
+            return False
+        replies.put(message)
+        return True
+
+    def close(self):
+        with self.pending_lock:
+            for replies in self.pending.values():  # wake every command still waiting on the CLI
+                replies.put(None)
+            for cancelled in self.cancellations.values():  # and stop the ones still working for it
+                cancelled.set()
+        self.workers.shutdown(wait=False, cancel_futures=True)
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)  # wakes the session thread if it is blocked reading
+        except OSError:
+            pass
+        try:
+            self.connection.close()
+        except OSError:
+            pass
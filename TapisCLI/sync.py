@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import tempfile
+import posixpath
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from . import helpers
+    from . import transfers
+    from . import exceptions
+except:
+    import helpers
+    import transfers
+    import exceptions
+
+
+# the server is multithreaded, and a forked child can inherit a lock some other thread held at the time and hang on
+# it. Hashing workers start from a clean process instead
+HASH_CONTEXT = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+def hash_file(path: str) -> str: # module level so worker processes can run it
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(transfers.CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    what was last synced between one local directory and one path on a tapis system. For every file it keeps the
+    local size, mtime and content hash, and the remote size and modification time seen at the time
+    """
+    def __init__(self, system_id: str, local_root: str, remote_root: str):
+        key = hashlib.sha1(f"{os.path.abspath(local_root)}|{remote_root.strip('/')}".encode('utf-8')).hexdigest()
+        self.path = os.path.join(helpers.app_path('manifests', system_id), f"{key}.json")
+        self.entries = dict()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(self.path), suffix='.tmp', delete=False) as f:
+            json.dump(self.entries, f) # a file of its own, so concurrent syncs of one directory never write into each other's
+        os.replace(f.name, self.path) # never leave a half written manifest behind
+
+    def local_hashes(self, local_root: str, parallel: int, cancelled=None) -> dict:
+        """
+        relative path -> (size, mtime, hash) for every local file. Files whose size and mtime match the manifest
+        keep their recorded hash, the rest are hashed in worker processes. A cancel is noticed between hashes
+        """
+        stats, hashes, stale = dict(), dict(), list()
+        for path in transfers.walk_local(local_root):
+            relative = os.path.relpath(path, local_root).replace(os.sep, '/')
+            stat = os.stat(path)
+            stats[relative] = (stat.st_size, stat.st_mtime)
+            entry = self.entries.get(relative)
+            if entry and (entry['size'], entry['mtime']) == stats[relative]:
+                hashes[relative] = entry['hash']
+            else:
+                stale.append(relative)
+        if stale:
+            with ProcessPoolExecutor(max_workers=parallel, mp_context=HASH_CONTEXT) as pool:
+                paths = [os.path.join(local_root, *relative.split('/')) for relative in stale]
+                for relative, digest in zip(stale, pool.map(hash_file, paths, chunksize=16)):
+                    if cancelled is not None and cancelled.is_set():
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise exceptions.Cancelled(f"cancelled after hashing {len(hashes)} of {len(stats)} files")
+                    hashes[relative] = digest
+        return {relative:(*stats[relative], hashes[relative]) for relative in stats}
+
+    def changed(self, relative: str, local: tuple | None, remote) -> bool:
+        """
+        whether a file differs between the two sides, or either side moved on since it was last synced
+        """
+        entry = self.entries.get(relative)
+        if entry is None or local is None or remote is None:
+            return True
+        return (local[2] != entry['hash'] or local[0] != remote.size
+                or (remote.size, str(remote.lastModified)) != (entry['remote_size'], entry['remote_modified']))
+
+    def record(self, relative: str, local: tuple, remote):
+        self.entries[relative] = {'size':local[0], 'mtime':local[1], 'hash':local[2],
+                                  'remote_size':remote.size, 'remote_modified':str(remote.lastModified)}
+
+
+def remote_listing(t, system_id: str, remote_root: str) -> dict:
+    try:
+        entries = transfers.walk_remote(t, system_id, remote_root)
+    except transfers.tapis_errors.NotFoundError: # nothing has been pushed there yet
+        return dict()
+    return {transfers.remote_relative_path(entry.path, remote_root):entry for entry in entries}
+
+
+def plan(manifest: Manifest, local: dict, remote: dict, direction: str) -> list[str]:
+    """
+    relative paths that have to move. Pushing considers every local file, pulling every remote one
+    """
+    source = local if direction == 'push' else remote
+    return [relative for relative in source if manifest.changed(relative, local.get(relative), remote.get(relative))]
+
+
+def sync(t, system_id: str, local_root: str, remote_root: str, direction: str, parallel: int,
+         report=None, cancelled=None) -> tuple[list, dict, int]:
+    """
+    bring the destination side up to date with the source side, moving only new or changed files.
+    Returns the transferred paths, the failures and how many files were already up to date
+    """
+    manifest = Manifest(system_id, local_root, remote_root)
+    local = manifest.local_hashes(local_root, parallel, cancelled)
+    remote = remote_listing(t, system_id, remote_root)
+    pending = plan(manifest, local, remote, direction)
+    transfers.widen_connection_pool(t, parallel)
+
+    tasks = dict()
+    for relative in pending:
+        local_path = os.path.join(local_root, *relative.split('/'))
+        remote_path = posixpath.join(remote_root, relative)
+        if direction == 'push':
+            tasks[relative] = partial(transfers.stream_upload, t, local_path, system_id, remote_path, cancelled=cancelled)
+        else:
+            os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+            tasks[relative] = partial(transfers.stream_download, t, transfers.content_url(t, system_id, remote_path),
+                                      local_path, total=remote[relative].size, cancelled=cancelled)
+    done, failed = transfers.run_parallel(tasks, parallel, report=report, cancelled=cancelled)
+
+    # both sides changed for the files that moved, so take a fresh look before recording them
+    local = manifest.local_hashes(local_root, parallel, cancelled) if direction == 'pull' and done else local
+    remote = remote_listing(t, system_id, remote_root) if direction == 'push' and done else remote
+    for relative in set(local) & set(remote):
+        if relative not in failed:
+            manifest.record(relative, local[relative], remote[relative])
+    manifest.save()
+    return done, failed, len(local if direction == 'push' else remote) - len(pending)
@@ -2,23 +2,48 @@ import json
 import os
 import re
 import sys
-import pyperclip
+import time
+import datetime
+import posixpath
+from functools import partial
 from tapipy import tapis
 import tapipy
-from py2neo import Graph
 import typing
 from TypeEnforcement.type_enforcer import TypeEnforcer
 try:
     from . import helpers
     from . import decorators
     from . import args
+    from . import transfers
+    from . import sync
+    from . import file_index
+    from . import cache
+    from . import job_watcher
+    from . import job_sweep
+    from . import job_outputs
+    from . import metrics
+    from . import exceptions
 except:
     import helpers 
     import decorators
     import args
+    import transfers
+    import sync
+    import file_index
+    import cache
+    import job_watcher
+    import job_sweep
+    import job_outputs
+    import metrics
+    import exceptions
+neo4j_pool = helpers.lazy_import('neo4j_pool', __package__) # py2neo is only loaded once a neo4j command runs
+neo4j_io = helpers.lazy_import('neo4j_io', __package__)
 
 
 class tapisObject(helpers.OperationsHelper, decorators.DecoratorSetup, helpers.DynamicHelpUtility):
+    cache_ttls: dict = dict() # read only command -> seconds its result stays cached
+    invalidates: dict = dict() # mutating command -> read only commands whose cached results it makes stale
+
     def __init__(self, tapis_instance, username, password, connection, command_map=None):
         self.t = tapis_instance
         self.username = username
@@ -26,17 +51,62 @@ class tapisObject(helpers.OperationsHelper, decorators.DecoratorSetup, helpers.D
         self.connection = connection
 
         self.command_map = command_map
+        self.cache = cache.TTLCache()
         
         if self.command_map:
-            self.help = self.help_generation()
+            self.registry = self.command_registry()
+            self.help = self.registry['help']
 
     def __call__(self, **kwargs):
-        try:
-            command = self.command_map[kwargs['command']]
-            kwargs = self.filter_kwargs(command, kwargs)
-            return command(**kwargs)
-        except (tapipy.errors.NotFoundError, tapipy.errors.BadRequestError, tapipy.errors.BaseTapyException) as e:
-            return str(e)
+        group, command_name = getattr(self, 'group_name', self.__class__.__name__.lower()), kwargs.get('command')
+        key = f"{group}.{command_name if command_name in self.command_map else metrics.UNKNOWN}"
+        with metrics.recorder.measure(key):
+            try:
+                command_name = kwargs['command']
+                command = self.command_map[command_name]
+                fresh = kwargs.get('fresh')
+                kwargs = self.filter_kwargs(command, kwargs, self.registry['parameters'][command_name])
+                if command_name in self.cache_ttls:
+                    return self.cached_call(command_name, command, kwargs, fresh)
+                try:
+                    return command(**kwargs)
+                finally:
+                    self.invalidate(command_name, kwargs)
+            except (tapipy.errors.NotFoundError, tapipy.errors.BadRequestError, tapipy.errors.BaseTapyException) as e:
+                metrics.recorder.error(key)  # answered, but the command still failed
+                return str(e)
+
+    def cached_call(self, command_name: str, command: typing.Callable, kwargs: dict, fresh: bool):
+        """
+        serve a read only command from the cache unless it is missing, expired or --fresh was given
+        """
+        key = (command_name, tuple(sorted(kwargs.items())))
+        if not fresh:
+            hit, result = self.cache.get(key)
+            if hit:
+                return result
+        result = command(**kwargs)
+        self.cache.put(key, result, self.cache_ttls[command_name], tags=(command_name, (command_name, kwargs.get('id'))))
+        return result
+
+    def invalidate(self, command_name: str, kwargs: dict):
+        """
+        drop cached results a mutating command made stale. With an id only that resource and the listings go,
+        otherwise everything cached for the affected commands does
+        """
+        for read_command in self.invalidates.get(command_name, ()):
+            if kwargs.get('id') is not None:
+                self.cache.invalidate((read_command, kwargs['id']))
+                self.cache.invalidate((read_command, None))
+            else:
+                self.cache.invalidate(read_command)
+
+    def stream(self, message):
+        """
+        send output to the CLI while the command is still running
+        """
+        if self.session:
+            self.session.stream(message)
     
     def help(self, name: typing.Optional[str]):
         """
@@ -51,6 +121,14 @@ class Systems(tapisObject):
     """
     @help: Access Tapis systems through the connected service
     """
+    cache_ttls = {'get_systems':30, 'get_system_info':60}
+    invalidates = {
+        'create_system':['get_systems'],
+        'delete_system':['get_systems', 'get_system_info'],
+        'set_credentials':['get_system_info'],
+        'set_password':['get_system_info']
+    }
+
     def __init__(self, tapis_instance, username, password, connection):
         command_map = {
             'get_systems':self.get_systems,
@@ -93,7 +171,7 @@ class Systems(tapisObject):
         """
         @help: create a system from a descriptor file
         """
-        with open(file, 'r') as f:
+        with open(self.local_path(file), 'r') as f:
             system = json.loads(f.read())
         self.t.systems.createSystem(**system)
         return str
@@ -103,10 +181,10 @@ class Systems(tapisObject):
         @help: upload system credentials to a system
         @doc: Must generate keys first using 'ssh-keygen -m PEM -f id_rsa', and format with, 'awk -v ORS='\\n' '1' <private_key_name>'
         """
-        with open(file.split(",")[0], 'r') as f:
+        with open(self.local_path(file.split(",")[0]), 'r') as f:
             private_key = f.read()
 
-        with open(file.split(",")[1], 'r') as f:
+        with open(self.local_path(file.split(",")[1]), 'r') as f:
             public_key = f.read()
 
         cred_return_value = self.t.systems.createUserCredential(systemId=id,
@@ -136,38 +214,140 @@ class Systems(tapisObject):
 
 
 class Neo4jCLI(tapisObject):
-    def __init__(self, tapis_object, uname, pword, connection):
-        super().__init__(tapis_object, uname, pword, connection)
+    """
+    @help: Query Neo4j knowledge graphs hosted on Tapis pods
+    """
+    group_name = 'neo4j' # the command group this wrapper is reached through
+    def __init__(self, tapis_object, uname, pword, connection, pool_size: int=4, idle_timeout: float=600,
+                 query_ttl: float=30):
+        command_map = {
+            'submit_query':self.submit_query,
+            'export_query':self.export_query,
+            'bulk_import':self.bulk_import,
+            'pool_stats':self.pool_stats,
+            'help':self.help
+        }
+        super().__init__(tapis_object, uname, pword, connection, command_map=command_map)
+        helpers.load(neo4j_pool), helpers.load(neo4j_io) # py2neo comes in here, before any command thread can use it
         self.t = tapis_object
+        self.graphs = neo4j_pool.GraphPool(tapis_object, max_size=pool_size, idle_timeout=idle_timeout)
+        self.query_ttl = query_ttl # seconds a read query result stays cached, 0 turns the cache off
    
     @decorators.RequiresExpression
-    def submit_query(self, file: str, id: str, expression: str) -> str: # function to submit queries to a Neo4j knowledge graph
-        uname, pword = self.t.pods.get_pod_credentials(pod_id=id).user_username, self.t.pods.get_pod_credentials(pod_id=id).user_password
-        graph = Graph(f"bolt+ssc://{id}.pods.icicle.tapis.io:443", auth=(uname, pword), secure=True, verify=True)
+    def submit_query(self, file: str, id: str, expression: str, fresh: bool) -> str: # function to submit queries to a Neo4j knowledge graph
+        """
+        @help: run a cypher query against the knowledge graph on a pod, typed in or read from a file. Large results are streamed back a page at a time, repeated read queries are answered from a cache unless --fresh is given
+        """
         if file:
-            with open(file, 'r') as f:
+            with open(self.local_path(file), 'r') as f:
                 expression = f.read()
-        
+
+        writes = neo4j_io.is_write(expression)
+        key = neo4j_io.query_key(id, expression)
+        if self.query_ttl and not writes and not fresh:
+            hit, result = self.cache.get(key)
+            if hit:
+                return result
+        streamed = list() # pages already sent to the CLI, which a retry would send again
         try:
-            return_value = graph.run(expression)
-            print(type(return_value))
-            if str(return_value) == '(No data)' and 'create' in expression.lower(): # if no data is returned (mostly if something is created) then just say 'success'
-                return f'[+][{id}@pods.icicle.tapis.io:443] Success'
-            elif str(return_value) == '(No data)':
-                return f'[-][{id}@pods.icicle.tapis.io:443] KG is empty'
-
-            return str(f'[+][{id}] {return_value}')
+            result, complete = self.graphs.run(id, lambda graph: self.stream_pages(id, neo4j_io.record_pages(graph, expression, cancelled=self.cancelled), expression, streamed),
+                                               retryable=lambda: not writes and not streamed)
+        except exceptions.Cancelled:
+            raise # answered as a cancel by the server, not as a failed query
         except Exception as e:
             return str(e)
+        finally:
+            if writes: # whatever was cached for this pod may no longer be true
+                self.cache.invalidate(id)
+        if self.query_ttl and not writes and complete: # streamed results are never held, which keeps the cache small
+            self.cache.put(key, result, self.query_ttl, tags=(id,))
+        return result
+
+    def stream_pages(self, id: str, pages, expression: str, streamed: list) -> tuple[str, bool]:
+        """
+        a result that fits in one page comes back as the response like before, larger ones go out page by page as they
+        arrive, each one noted in streamed. Also says whether the response holds the complete result
+        """
+        held, count = None, 0
+        for page in pages:
+            if held:
+                self.stream(f'[+][{id}] {neo4j_io.render(held)}')
+                streamed.append(len(held))
+            held = page
+            count += len(page)
+        if streamed:
+            self.stream(f'[+][{id}] {neo4j_io.render(held)}')
+            return f'[+][{id}] {count} records', False
+        elif held:
+            return f'[+][{id}] {neo4j_io.render(held)}', True
+        elif 'create' in expression.lower(): # if no data is returned (mostly if something is created) then just say 'success'
+            return f'[+][{id}@pods.icicle.tapis.io:443] Success', True
+        return f'[-][{id}@pods.icicle.tapis.io:443] KG is empty', True
+
+    @decorators.RequiresExpression
+    def export_query(self, file: str, id: str, expression: str, output: str) -> str:
+        """
+        @help: run a cypher query against the knowledge graph on a pod and write the records to a .csv or .ndjson file on the server as they arrive
+        """
+        if file:
+            with open(self.local_path(file), 'r') as f:
+                expression = f.read()
+        output = self.local_path(output)
+
+        try:
+            start = time.time()
+            written = self.graphs.run(id, lambda graph: neo4j_io.export_records(neo4j_io.record_pages(graph, expression, cancelled=self.cancelled),
+                                                                                 output, report=self.stream),
+                                      retryable=lambda: not neo4j_io.is_write(expression)) # a rerun rewrites the file from the start
+            return f'[+][{id}] exported {written} records to {output} in {time.time() - start:.2f}s'
+        except exceptions.Cancelled:
+            raise # answered as a cancel by the server, not as a failed query
+        except Exception as e:
+            return str(e)
+
+    @decorators.RequiresExpression
+    def bulk_import(self, file: str, id: str, expression: str, batch_size: int, parallel: int) -> str:
+        """
+        @help: load the rows of a .csv or .ndjson file into the knowledge graph on a pod in batched transactions. The cypher refers to each row as 'row', for example MERGE (p:Person {id: row.id}) SET p += row
+        """
+        cypher = neo4j_io.unwind_query(expression)
+        parallel = min(parallel or 1, self.graphs.max_size) # the writers share the pod's connection pool
+        try:
+            rows, batches, seconds = neo4j_io.bulk_import(
+                lambda batch: self.graphs.run(id, lambda graph: neo4j_io.write_batch(graph, cypher, batch)),
+                self.local_path(file), batch_size or neo4j_io.BATCH_SIZE, parallel, report=self.stream, cancelled=self.cancelled)
+            return f'[+][{id}] imported {rows} rows in {batches} batches in {seconds:.2f}s ({rows / max(seconds, 1e-9):.0f} rows/s)'
+        except exceptions.Cancelled:
+            raise # answered as a cancel by the server, not as a failed query
+        except Exception as e:
+            return str(e)
+        finally:
+            self.cache.invalidate(id)
+
+    def pool_stats(self) -> dict:
+        """
+        @help: show the open pod connections with their connect time and first versus warm query latency
+        """
+        return self.graphs.stats()
 
 
 class Pods(tapisObject):
     """
     @help: Access Tapis pods through the connected service
     """
+    cache_ttls = {'get_pods':15, 'get_perms':60, 'whoami':600}
+    invalidates = {
+        'create_pod':['get_pods'],
+        'restart_pod':['get_pods'],
+        'delete_pod':['get_pods', 'get_perms'],
+        'set_pod_perms':['get_perms'],
+        'delete_pod_perms':['get_perms']
+    }
+
     def __init__(self, tapis_instance, username, password, connection):
         command_map = {
                 'get_pods':self.get_pods,
+                'whoami':self.whoami,
                 'create_pod':self.create_pod,
                 'restart_pod':self.restart_pod,
                 'delete_pod':self.delete_pod,
@@ -261,6 +441,7 @@ class Pods(tapisObject):
         """
         @help: copy the pod password to the clipboard
         """
+        import pyperclip # only needed here, and it probes for a clipboard backend when imported
         password = self.t.pods.get_pod_credentials(pod_id=id).user_password
         pyperclip.copy(password)
         password = None
@@ -276,9 +457,15 @@ class Files(tapisObject):
             'list_files':self.list_files,
             'upload':self.upload,
             'download':self.download,
+            'upload_dir':self.upload_dir,
+            'download_dir':self.download_dir,
+            'sync':self.sync,
+            'index':self.index,
+            'find':self.find,
             'help':self.help
         }
         super().__init__(tapis_instance, username, password, connection, command_map=command_map)
+        self.file_index = file_index.FileIndex()
 
     def return_formatter(self, info):
         return f"name: {info.name}\ngroup: {info.group}\npath: {info.path}\n"
@@ -296,33 +483,122 @@ class Files(tapisObject):
     def upload(self, file: str, id: str) -> str: # upload a file from local to remote using tapis. Takes source and destination paths
         """
         @help: upload a file to the system
+        @doc: the file is streamed from disk, so memory use stays constant no matter how big it is
         """
-        source = file.split(",")[0]
+        source = self.local_path(file.split(",")[0])
         destination = file.split(",")[1]
-        self.t.upload(system_id=id,
-                source_file_path=source,
-                dest_file_path=destination)
-        return f'successfully uploaded {source} to {destination}'
+        progress = transfers.stream_upload(self.t, source, id, destination, report=self.stream, cancelled=self.cancelled)
+        return f'successfully uploaded {source} to {destination}, {progress.summary()}'
             
-    def download(self, file: str, id: str) -> str: # download a remote file using tapis, operates basically the same as upload
+    def download(self, file: str, id: str, resume: bool) -> str: # download a remote file using tapis, operates basically the same as upload
         """
-        @help: download a file from the system
+        @help: download a file from the system. Use --resume to continue a partial download
+        @doc: the file is streamed to disk in chunks as bytes, so binaries and multi GB files are fine
         """
         source = file.split(",")[0]
-        destination = file.split(",")[1]
-        file_info = self.t.files.getContents(systemId=id,
-                            path=source)
-
-        file_info = file_info.decode('utf-8')
-        with open(destination, 'w') as f:
-            f.write(file_info)
-        return f'successfully downloaded {source} to {destination}'
+        destination = self.local_path(file.split(",")[1])
+        total = transfers.remote_size(self.t, id, source)
+        offset = 0
+        if resume and os.path.exists(destination):
+            offset = os.path.getsize(destination)
+            if total is not None and offset >= total:
+                return f'{destination} is already complete'
+        progress = transfers.stream_download(self.t, transfers.content_url(self.t, id, source), destination,
+                                             offset=offset, total=total, report=self.stream, cancelled=self.cancelled)
+        return f'successfully downloaded {source} to {destination}, {progress.summary()}'
+
+    def transfer_summary(self, done: list, failed: dict, start: float) -> str:
+        summary = f'transferred {len(done)} files in {time.time() - start:.2f}s'
+        if failed:
+            summary += f', {len(failed)} failed:\n' + '\n'.join(f'{name}: {error}' for name, error in failed.items())
+        return summary
+
+    def upload_dir(self, file: str, id: str, parallel: int) -> str: # upload a local directory tree, several files at a time
+        """
+        @help: upload a directory recursively. The source can end in a name pattern, like results/*.csv
+        @doc: files move through a pool of --parallel workers (default 8), each retried up to 3 times
+        """
+        source, destination = self.local_path(file.split(",")[0]), file.split(",")[1]
+        start = time.time()
+        root, pattern = transfers.split_pattern(source)
+        parallel = parallel or 8
+        transfers.widen_connection_pool(self.t, parallel)
+        tasks = dict()
+        for local_path in transfers.walk_local(root, pattern):
+            relative = os.path.relpath(local_path, root).replace(os.sep, '/')
+            if relative == '.': # the source was a single file
+                relative = os.path.basename(local_path)
+            tasks[relative] = partial(transfers.stream_upload, self.t, local_path, id, posixpath.join(destination, relative),
+                                      cancelled=self.cancelled)
+        done, failed = transfers.run_parallel(tasks, parallel, report=self.stream, cancelled=self.cancelled)
+        return self.transfer_summary(done, failed, start)
+
+    def sync(self, file: str, id: str, direction: str, parallel: int) -> str: # only move what changed since the last sync
+        """
+        @help: sync a local directory and a system directory (local,remote). --direction push (default) or pull
+        @doc: a manifest of sizes, mtimes and sha256 hashes is kept under ~/.tapis-cli/manifests, so files that did not change are skipped
+        """
+        local_root, remote_root = self.local_path(file.split(",")[0]), file.split(",")[1]
+        start = time.time()
+        done, failed, unchanged = sync.sync(self.t, id, local_root, remote_root, direction or 'push', parallel or 8,
+                                            report=self.stream, cancelled=self.cancelled)
+        return f'{unchanged} files up to date, ' + self.transfer_summary(done, failed, start)
+
+    def index(self, id: str, file: str) -> str: # crawl a system into the local index used by find
+        """
+        @help: build or refresh the local index of a system's files under a path (the whole system if no path is given)
+        """
+        start = time.time()
+        seen, removed = self.file_index.crawl(self.t, id, file or '/', report=self.stream, cancelled=self.cancelled)
+        return f'indexed {seen} entries under {file or "/"} on {id} in {time.time() - start:.2f}s, {removed} stale entries removed'
+
+    def find(self, id: str, file: str, name: str, size: str, age: str) -> str: # query the local index, no tapis calls
+        """
+        @help: find indexed files by name pattern, size (+10M, -1K) and age (-2d, +4w), optionally under a path
+        @doc: answers come from the index built by files -c index, refresh it to pick up remote changes
+        """
+        start = time.time()
+        if self.file_index.last_crawl(id) is None:
+            return f'{id} has not been indexed yet, run files -c index -i {id} first'
+        rows = self.file_index.find(id, root=file, name=name, size=size, age=age)
+        lines = [f"{path}  {kind}  {size_} bytes  {datetime.datetime.fromtimestamp(modified) if modified else ''}"
+                 for path, kind, size_, modified in rows]
+        lines.append(f'{len(rows)} matches in {(time.time() - start) * 1000:.1f} ms')
+        return '\n'.join(lines)
+
+    def download_dir(self, file: str, id: str, parallel: int) -> str: # download a remote directory tree, several files at a time
+        """
+        @help: download a directory recursively. The source can end in a name pattern, like results/*.out
+        @doc: files move through a pool of --parallel workers (default 8), each retried up to 3 times
+        """
+        source, destination = file.split(",")[0], self.local_path(file.split(",")[1])
+        start = time.time()
+        root, pattern = transfers.split_pattern(source)
+        parallel = parallel or 8
+        transfers.widen_connection_pool(self.t, parallel)
+        tasks = dict()
+        for entry in transfers.walk_remote(self.t, id, root, pattern):
+            relative = transfers.remote_relative_path(entry.path, root)
+            if relative == '.': # the source was a single file
+                relative = entry.name
+            local_path = os.path.join(destination, *relative.split('/'))
+            os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+            tasks[relative] = partial(transfers.stream_download, self.t, transfers.content_url(self.t, id, entry.path),
+                                      local_path, total=entry.size, cancelled=self.cancelled)
+        done, failed = transfers.run_parallel(tasks, parallel, report=self.stream, cancelled=self.cancelled)
+        return self.transfer_summary(done, failed, start)
 
 
 class Apps(tapisObject):
     """
     @help: Access Tapis systems through the connected service
     """
+    cache_ttls = {'get_apps':60, 'get_app_info':300}
+    invalidates = {
+        'create_app':['get_apps', 'get_app_info'],
+        'delete_app':['get_apps', 'get_app_info']
+    }
+
     def __init__(self, tapis_instance, username, password, connection):
         command_map = {
             'create_app':self.create_app,
@@ -330,17 +606,25 @@ class Apps(tapisObject):
             'delete_app':self.delete_app,
             'get_app_info':self.get_app,
             'run_app':self.run_job,
+            'sweep':self.sweep,
             'get_app_status':self.get_job_status,
             'download_app_results':self.download_job_output,
+            'tail_app_output':self.tail_job_output,
+            'download_app_outputs':self.download_job_outputs,
+            'watch_jobs':self.watch_jobs,
+            'wait':self.wait,
+            'watched_jobs':self.watched_jobs,
             'help':self.help,
         }
         super().__init__(tapis_instance, username, password, connection, command_map=command_map)
+        self.watcher = job_watcher.JobWatcher(tapis_instance)
+        self.submitted = list() # uuids of the jobs run_app submitted, what watch_jobs and wait use when given none
 
     def create_app(self, file: str) -> str: # create a tapis app taking a json descriptor file path
         """
         @help: create an app 
         """
-        with open(file, 'r') as f:
+        with open(self.local_path(file), 'r') as f:
             app_def = json.loads(f.read())
         url = self.t.apps.createAppVersion(**app_def)
         return f"App created successfully\nID: {app_def['id']}\nVersion: {app_def['version']}\nURL: {url}\n"
@@ -373,11 +657,33 @@ class Apps(tapisObject):
         """
         @help: run a job from an app on a system
         """
-        with open(file, 'r') as f:
+        with open(self.local_path(file), 'r') as f:
             app = json.loads(f.read())
         job = self.t.jobs.submitJob(**app)
+        self.submitted.append(job.uuid)
         return str(job.uuid)
 
+    def sweep(self, file: str, params: str, parallel: int, rate: float, output: str) -> str: # many jobs from one template
+        """
+        @help: submit a job per parameter set from a job descriptor template, with {{name}} placeholders filled from a .csv (one job per row) or a .json grid (one job per combination)
+        @doc: jobs go out --parallel at a time (default 8), at most --rate per second (default 10), retrying transient failures. The uuids are written to a manifest file
+        """
+        with open(self.local_path(file), 'r') as f:
+            template = json.load(f)
+        parameters = job_sweep.parameter_sets(self.local_path(params))
+        start = time.time()
+        manifest = job_sweep.sweep(lambda descriptor: self.t.jobs.submitJob(**descriptor), template, parameters,
+                                   parallel=parallel or 8, rate=rate or job_sweep.RATE, report=self.stream,
+                                   cancelled=self.cancelled)
+        path = job_sweep.write_manifest(manifest, self.local_path(output))
+        submitted = [entry['uuid'] for entry in manifest if entry['uuid']]
+        self.submitted.extend(submitted)
+        summary = f'submitted {len(submitted)}/{len(manifest)} jobs in {time.time() - start:.2f}s, manifest at {path}'
+        failed = [entry for entry in manifest if entry['error']]
+        if failed:
+            summary += f', {len(failed)} failed:\n' + '\n'.join(f"{entry['index']} {entry['parameters']}: {entry['error']}" for entry in failed[:20])
+        return summary
+
     def get_job_status(self, uuid: str)->str: # return a job status with its Uuid
         """
         @help: get the status of a job
@@ -385,11 +691,79 @@ class Apps(tapisObject):
         job_status = self.t.jobs.getJobStatus(jobUuid=uuid)
         return str(job_status)
 
+    def job_uuids(self, uuid: str | None) -> list[str]:
+        return [job.strip() for job in uuid.split(',') if job.strip()] if uuid else list(self.submitted)
+
+    def watch_jobs(self, uuid: str) -> str: # follow jobs in the background
+        """
+        @help: watch jobs (comma separated uuids, or every job submitted with run_app) and get told when their state changes
+        @doc: one background poller serves every watcher, asking about due jobs in batches and backing off while a job's state holds still
+        """
+        uuids = self.job_uuids(uuid)
+        if not uuids:
+            return 'no jobs to watch, give uuids or submit some with run_app'
+        self.watcher.watch(uuids, notify=self.session.notify if self.session else None)
+        return f'watching {len(uuids)} jobs'
+
+    def wait(self, uuid: str) -> str: # block until jobs finish, the server does the polling
+        """
+        @help: wait until jobs (comma separated uuids, or every job submitted with run_app) are finished, failed or cancelled
+        """
+        uuids = self.job_uuids(uuid)
+        if not uuids:
+            return 'no jobs to wait on, give uuids or submit some with run_app'
+        start = time.time()
+        states = self.watcher.wait(uuids, cancelled=self.cancelled, report=self.stream)
+        summary = ', '.join(f'{sum(state == final for state in states.values())} {final.lower()}'
+                            for final in sorted(set(states.values())))
+        return f'{len(states)} jobs done in {time.time() - start:.0f}s: {summary}'
+
+    def watched_jobs(self) -> str:
+        """
+        @help: show the jobs being watched, their last known state and when they are polled next
+        """
+        return json.dumps({'jobs':self.watcher.stats(), 'requests':self.watcher.requests}, indent=1)
+
     def download_job_output(self, uuid: str, file: str)->str: # download the output of a job with its Uuid
         """
         @help: download a job output from the system 
         """
-        jobs_output = self.t.jobs.getJobOutputDownload(jobUuid=uuid, outputPath='tapisjob.out')
-        with open(file, 'w') as f:
-            f.write(jobs_output)
-        return f"Successfully downloaded job output to {file}"
\ No newline at end of file
+        file = self.local_path(file)
+        progress = transfers.stream_download(self.t, transfers.job_output_url(self.t, uuid, 'tapisjob.out'), file,
+                                             report=self.stream, cancelled=self.cancelled)
+        return f"Successfully downloaded job output to {file}, {progress.summary()}"
+
+    def tail_job_output(self, uuid: str, file: str) -> str: # follow a running job's output
+        """
+        @help: follow the output of a job as it runs until it finishes, optionally saving it to a file on the way
+        @doc: only the bytes written since the last look are fetched, looking less often while the output is quiet
+        """
+        start = time.time()
+        size, status = job_outputs.tail(self.t, uuid, self.stream, destination=self.local_path(file), cancelled=self.cancelled)
+        return f"{uuid} {status}, {size} bytes of output in {time.time() - start:.0f}s"
+
+    def download_job_outputs(self, uuid: str, file: str, parallel: int, archive: bool) -> str: # many jobs' outputs at once
+        """
+        @help: download the output directories of jobs (comma separated uuids, or every job submitted with run_app) into a directory, one subdirectory per job
+        @doc: --parallel transfers at once (default 8). With --archive each job's outputs come as one tar.gz stream unpacked as it arrives, otherwise file by file
+        """
+        uuids = self.job_uuids(uuid)
+        if not uuids:
+            return 'no jobs to download, give uuids or submit some with run_app'
+        destination, start = self.local_path(file or '.'), time.time()
+        parallel = parallel or 8
+        transfers.widen_connection_pool(self.t, parallel)
+        tasks = dict()
+        for job_uuid in uuids:
+            if archive:
+                tasks[job_uuid] = partial(job_outputs.extract_archive, self.t, job_uuid, os.path.join(destination, job_uuid),
+                                          cancelled=self.cancelled)
+                continue
+            for relative, entry in job_outputs.output_files(self.t, job_uuid):
+                local_path = os.path.join(destination, job_uuid, *relative.split('/'))
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                tasks[f'{job_uuid}/{relative}'] = partial(transfers.stream_download, self.t,
+                                                          transfers.job_output_url(self.t, job_uuid, relative), local_path,
+                                                          total=getattr(entry, 'size', None), cancelled=self.cancelled)
+        done, failed = transfers.run_parallel(tasks, parallel, report=self.stream, cancelled=self.cancelled)
+        return self.transfer_summary(done, failed, start)
\ No newline at end of file
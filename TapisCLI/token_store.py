@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import datetime
+import threading
+import typing
+from tapipy.tapis import Tapis
+from tapipy import errors as tapis_errors
+try:
+    from . import helpers
+except:
+    import helpers
+
+
+REFRESH_MARGIN = 300 # seconds before the access token expires that it gets renewed
+CHECK_INTERVAL = 60 # seconds between the background refresher's looks at the tokens
+
+
+def client_credentials() -> dict:
+    """
+    tapis only issues refresh tokens, and only accepts them back, for a registered oauth client
+    """
+    client_id, client_key = os.environ.get('TAPIS_CLIENT_ID'), os.environ.get('TAPIS_CLIENT_KEY')
+    return {'client_id':client_id, 'client_key':client_key} if client_id and client_key else dict()
+
+
+def seconds_left(token) -> float:
+    expires_at = getattr(token, 'expires_at', None)
+    if expires_at is None:
+        return 0
+    return (expires_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+
+
+def tenant_id(t: Tapis) -> str | None:
+    claims = getattr(t.access_token, 'claims', None) or dict()
+    return getattr(t, 'tenant_id', None) or claims.get('tapis/tenant_id')
+
+
+def restore(entry: dict) -> Tapis:
+    """
+    a tapis client built from stored tokens. With the tenant known, tapipy skips its tenants lookup and nothing
+    goes over the network
+    """
+    return Tapis(base_url=entry['base_url'], username=entry['username'], tenant_id=entry.get('tenant_id'),
+                 access_token=entry['access_token'], refresh_token=entry.get('refresh_token'), **client_credentials())
+
+
+def renew(t: Tapis, password: str | None=None, margin: float=REFRESH_MARGIN) -> str | None:
+    """
+    make sure the access token outlives the margin. The refresh token is tried first and the password only when
+    that fails. Returns how the token was renewed, or None when it was still good
+    """
+    if seconds_left(t.access_token) > margin:
+        return None
+    if t.refresh_token and seconds_left(t.refresh_token) > 0:
+        try:
+            t.refresh_tokens()
+            return 'refresh'
+        except tapis_errors.BaseTapyException:
+            pass
+    if password:
+        t.get_tokens(username=t.username, password=password)
+        return 'password'
+    raise tapis_errors.TokenInvalidError(msg=f"The stored tokens for {t.username}@{t.base_url} have expired")
+
+
+class TokenStore:
+    """
+    the access and refresh tokens of every tapis login, keyed by base url and username, in a file only the
+    owner can read. The most recent login is what a freshly started server picks up
+    """
+    def __init__(self, path: str | None=None):
+        self.path = path or os.path.join(helpers.app_path('tokens'), 'tokens.json')
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(base_url: str, username: str) -> str:
+        return f"{username}@{base_url}"
+
+    def read(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'latest':None, 'logins':dict()}
+
+    def write(self, store: dict):
+        temporary = self.path + '.tmp'
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600) # never readable by anyone else, even briefly
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(store, f)
+        os.replace(temporary, self.path)
+
+    def save(self, t: Tapis):
+        """
+        record the client's current tokens. Nothing derived from the password is kept, a stolen file would only
+        give an offline guessing target on top of tokens that expire anyway
+        """
+        with self.lock:
+            store = self.read()
+            key = self.key(t.base_url, t.username)
+            entry = store['logins'].get(key, dict())
+            entry.update({'base_url':t.base_url, 'username':t.username, 'tenant_id':tenant_id(t),
+                          'access_token':t.get_access_jwt(), 'refresh_token':getattr(t.refresh_token, 'refresh_token', None), 'saved':time.time()})
+            entry.pop('password', None) # the verifier older versions kept
+            store['logins'][key] = entry
+            store['latest'] = key
+            self.write(store)
+
+    def get(self, base_url: str, username: str) -> dict | None:
+        return self.read()['logins'].get(self.key(base_url, username))
+
+    def latest(self) -> dict | None:
+        store = self.read()
+        return store['logins'].get(store['latest']) if store['latest'] else None
+
+
+class TokenRefresher(threading.Thread):
+    """
+    renews access tokens in the background before they expire, so no command ever waits on a token refresh.
+    logins() returns (tapis client, password or None) pairs for every login currently held
+    """
+    def __init__(self, store: TokenStore, logins: typing.Callable[[], list[tuple[Tapis, str | None]]],
+                 logger=None, interval: float=CHECK_INTERVAL):
+        super().__init__(name="token-refresher", daemon=True)
+        self.store = store
+        self.logins = logins
+        self.logger = logger
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for t, password in self.logins():
+                try:
+                    if renew(t, password):
+                        self.store.save(t)
+                except Exception as e: # keep the thread alive, the next command will surface the problem
+                    if self.logger:
+                        self.logger.warning(f"Could not renew the tokens for {t.username}@{t.base_url}: {e}")
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,361 @@
+import io
+import os
+import time
+import uuid
+import typing
+import fnmatch
+import posixpath
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import requests
+from tapipy import errors as tapis_errors
+try:
+    from . import exceptions
+except:
+    import exceptions
+
+
+CHUNK_SIZE = 2**20 # bytes held in memory at once while a file streams through
+PAGE_SIZE = 1000 # entries per listFiles page
+RETRIES = 3 # attempts per file in a multi file transfer
+
+
+class TransferProgress:
+    """
+    counts the bytes moved by one transfer and reports progress at most once per interval. Every chunk is also a
+    point where a cancelled transfer stops
+    """
+    def __init__(self, name: str, total: int | None, report: typing.Callable | None=None, interval: float=1.0, offset: int=0,
+                 cancelled: threading.Event | None=None):
+        self.name = name
+        self.total = total
+        self.report = report
+        self.interval = interval
+        self.offset = offset # bytes that were already there before this transfer started, when resuming
+        self.transferred = 0
+        self.start = time.time()
+        self.last_report = self.start
+        self.cancelled = cancelled
+
+    def update(self, count: int):
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise exceptions.Cancelled(f"{self.name} cancelled after {self.offset + self.transferred} bytes")
+        self.transferred += count
+        now = time.time()
+        if self.report and now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(self.status())
+
+    def elapsed(self) -> float:
+        return max(time.time() - self.start, 1e-9)
+
+    def rate(self) -> float: # MB/s
+        return self.transferred / self.elapsed() / 2**20
+
+    def status(self) -> str:
+        done = self.offset + self.transferred
+        if self.total:
+            return f"{self.name}: {done}/{self.total} bytes ({done / self.total:.0%}) at {self.rate():.2f} MB/s"
+        return f"{self.name}: {done} bytes at {self.rate():.2f} MB/s"
+
+    def summary(self) -> str:
+        return f"{self.transferred} bytes in {self.elapsed():.2f}s ({self.rate():.2f} MB/s)"
+
+
+class MultipartFileStream:
+    """
+    file like multipart/form-data body. The file is read chunk by chunk as requests sends it,
+    so an upload holds one chunk in memory no matter how big the file is
+    """
+    def __init__(self, path: str, field: str='file', progress: TransferProgress | None=None):
+        self.boundary = uuid.uuid4().hex
+        head = (f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field}"; filename="{os.path.basename(path)}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self.file = open(path, 'rb')
+        self.length = len(head) + os.path.getsize(path) + len(tail) # known up front, so no chunked encoding is needed
+        self.parts = [io.BytesIO(head), self.file, io.BytesIO(tail)]
+        self.progress = progress
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size: int=-1) -> bytes:
+        data = b''
+        while self.parts and (size < 0 or len(data) < size):
+            chunk = self.parts[0].read(-1 if size < 0 else size - len(data))
+            if not chunk:
+                self.parts.pop(0)
+                continue
+            if self.parts[0] is self.file and self.progress:
+                self.progress.update(len(chunk))
+            data += chunk
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def auth_headers(t) -> dict:
+    return {'X-Tapis-Token': t.get_access_jwt()}
+
+
+def content_url(t, system_id: str, path: str) -> str:
+    return f"{t.base_url}/v3/files/content/{system_id}/{path.lstrip('/')}"
+
+
+def job_output_url(t, job_uuid: str, output_path: str) -> str:
+    return f"{t.base_url}/v3/jobs/{job_uuid}/output/download/{output_path.lstrip('/')}"
+
+
+def raise_for_status(response):
+    if response.status_code >= 300: # surface http errors the same way tapipy does, so the wrappers handle them alike
+        raise tapis_errors.BaseTapyException(msg=f"{response.status_code} {response.reason}: {response.text[:500]}", response=response)
+
+
+def byte_range(offset: int, end: int) -> dict:
+    """
+    the header asking tapis for the bytes from offset up to end. The files service reads 'range: a,b' as b bytes
+    starting at a, despite documenting it as min,max, so this is the one place that convention lives
+    """
+    return {'range':f"{offset},{end - offset}"}
+
+
+def range_ignored(response, offset: int) -> bool:
+    """
+    whether a ranged request came back as the whole file, which older deployments do. Only a 206 carries the
+    range, whatever the length or encoding of the body. The caller drops or rewrites the first offset bytes then
+    """
+    return bool(offset) and response.status_code != 206
+
+
+def remote_size(t, system_id: str, path: str) -> int | None:
+    listing = t.files.listFiles(systemId=system_id, path=path)
+    if len(listing) == 1 and getattr(listing[0], 'type', 'file') == 'file':
+        return listing[0].size
+    return None
+
+
+def stream_download(t, url: str, destination: str, offset: int=0, total: int | None=None,
+                    report: typing.Callable | None=None, chunk_size: int=CHUNK_SIZE,
+                    cancelled: threading.Event | None=None) -> TransferProgress:
+    """
+    stream a tapis download straight to disk in chunks. A nonzero offset asks tapis for the bytes from there on
+    and appends them to what is already in the destination. Resuming needs the total size, without it the file
+    is fetched again from the start
+    """
+    headers = auth_headers(t)
+    if offset and total is None:
+        offset = 0
+    if offset:
+        headers.update(byte_range(offset, total))
+    with t.requests_session.get(url, headers=headers, stream=True, verify=t.verify) as response:
+        raise_for_status(response)
+        if range_ignored(response, offset): # the whole file is coming, write it out again
+            offset = 0
+        progress = TransferProgress(os.path.basename(destination), total, report, offset=offset, cancelled=cancelled)
+        with open(destination, 'ab' if offset else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                progress.update(len(chunk))
+    return progress
+
+
+def stream_upload(t, source: str, system_id: str, destination: str, report: typing.Callable | None=None,
+                  cancelled: threading.Event | None=None) -> TransferProgress:
+    """
+    upload a local file to a tapis system without reading it into memory
+    """
+    progress = TransferProgress(os.path.basename(source), os.path.getsize(source), report, cancelled=cancelled)
+    body = MultipartFileStream(source, progress=progress)
+    headers = dict(auth_headers(t), **{'Content-Type':body.content_type, 'Accept':'application/json'})
+    try:
+        response = t.requests_session.post(f"{t.base_url}/v3/files/ops/{system_id}/{destination.lstrip('/')}",
+                                           data=body, headers=headers, verify=t.verify)
+    finally:
+        body.close()
+    raise_for_status(response)
+    return progress
+
+
+def split_pattern(source: str) -> tuple[str, str | None]:
+    """
+    'dir/*.out' -> ('dir', '*.out'). A source without wildcards in its last component is a plain directory
+    """
+    root, name = posixpath.split(source.rstrip('/'))
+    if any(character in name for character in '*?['):
+        return root or '.', name
+    return source, None
+
+
+def walk_remote(t, system_id: str, path: str, pattern: str | None=None) -> list:
+    """
+    every file under path on a tapis system whose name matches the pattern, from paged recursive listings
+    """
+    files, offset = list(), 0
+    while True:
+        page = t.files.listFiles(systemId=system_id, path=path, recurse=True, limit=PAGE_SIZE, offset=offset)
+        files.extend(entry for entry in page
+                     if entry.type == 'file' and (not pattern or fnmatch.fnmatch(entry.name, pattern)))
+        if len(page) < PAGE_SIZE:
+            return files
+        offset += PAGE_SIZE
+
+
+def walk_local(path: str, pattern: str | None=None) -> list[str]:
+    """
+    every file under a local directory whose name matches the pattern
+    """
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(directory, name) for directory, _, names in os.walk(path)
+            for name in names if not pattern or fnmatch.fnmatch(name, pattern)]
+
+
+def remote_relative_path(entry_path: str, root: str) -> str:
+    return posixpath.relpath(entry_path.strip('/'), root.strip('/') or '.')
+
+
+class WideAdapter(requests.adapters.HTTPAdapter):
+    """
+    the stock adapter with a bigger connection pool, remembering how big
+    """
+    def __init__(self, width: int, max_retries):
+        super().__init__(pool_maxsize=width, max_retries=max_retries)
+        self.width = width
+
+
+def widen_connection_pool(t, size: int):
+    """
+    let the tapis client's http session keep a connection open per worker instead of the default 10. Only the stock
+    adapter requests mounts is swapped out, keeping its retry policy. An adapter configured by tapipy or the user is
+    left as it is
+    """
+    adapter = t.requests_session.get_adapter(t.base_url)
+    width = adapter.width if type(adapter) is WideAdapter else requests.adapters.DEFAULT_POOLSIZE
+    if type(adapter) in (requests.adapters.HTTPAdapter, WideAdapter) and width < size:
+        t.requests_session.mount(t.base_url, WideAdapter(size, adapter.max_retries))
+
+
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    ConnectionError, TimeoutError, tapis_errors.ServiceUnavailableError, tapis_errors.InternalServerError)
+
+
+def transient(error: Exception) -> bool:
+    """
+    whether a failed transfer is worth another go: dropped or timed out connections, server errors and rate limiting.
+    Bad credentials, missing files and full disks fail the same way every time
+    """
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(error, tapis_errors.BaseTapyException) and status is not None and (status >= 500 or status == 429)
+
+
+def with_retries(function: typing.Callable, retries: int=RETRIES, backoff: float=0.5):
+    for attempt in range(1, retries + 1):
+        try:
+            return function()
+        except Exception as e:
+            if attempt == retries or not transient(e):
+                raise
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def run_parallel(tasks: dict, parallel: int, report: typing.Callable | None=None, interval: float=1.0,
+                 cancelled: threading.Event | None=None) -> tuple[list, dict]:
+    """
+    run name -> transfer callables on a thread pool, at most parallel at once, retrying each failed one.
+    Progress is reported from the calling thread. Returns the names that finished and a dict of name -> error.
+    Once cancelled, queued transfers are dropped and the running ones, which should share the event, stop at
+    their next chunk
+    """
+    done, failed = list(), dict()
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="transfer") as pool:
+        futures = {pool.submit(with_retries, task):name for name, task in tasks.items()}
+        remaining, last_report = set(futures), time.time()
+        while remaining:
+            finished, remaining = wait(remaining, timeout=interval, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future.exception():
+                    failed[futures[future]] = str(future.exception())
+                else:
+                    done.append(futures[future])
+            if cancelled is not None and cancelled.is_set() and remaining:
+                for future in remaining:
+                    future.cancel()
+                wait(remaining)
+                raise exceptions.Cancelled(f"cancelled after {len(done)}/{len(tasks)} files were transferred")
+            if report and remaining and time.time() - last_report >= interval:
+                last_report = time.time()
+                report(f"{len(done) + len(failed)}/{len(tasks)} files transferred, {len(failed)} failed")
+    return done, failed
+
+
+if __name__ == "__main__":
+    # checks the range convention against a stand in for the files service that reads 'range: a,b' as b bytes from
+    # a, for a resumed download and for a tail picking up a grown file, and that both cope with a server that
+    # ignores the header, with and without a content-length
+    import tempfile
+    import itertools
+    try:
+        from . import job_outputs
+    except:
+        import job_outputs
+
+    class Response:
+        def __init__(self, body: bytes, status_code: int=200, chunked: bool=False):
+            self.status_code, self.reason, self.text = status_code, 'OK', ''
+            self.body, self.headers = body, {'transfer-encoding':'chunked'} if chunked else {'content-length':str(len(body))}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def iter_content(self, chunk_size: int):
+            for start in range(0, len(self.body), chunk_size):
+                yield self.body[start:start + chunk_size]
+
+    class Files:
+        def __init__(self, content: bytes, honor_range: bool=True, chunked: bool=False):
+            self.content, self.honor_range, self.chunked = content, honor_range, chunked
+
+        def get(self, url, headers, **kwargs):
+            if 'range' in headers and self.honor_range:
+                start, count = map(int, headers['range'].split(','))
+                return Response(self.content[start:start + count], 206, self.chunked)
+            return Response(self.content, 200, self.chunked)
+
+    class Client:
+        base_url, verify = 'https://tapis.example', True
+
+        def __init__(self, files: Files):
+            self.requests_session = files
+
+        def get_access_jwt(self):
+            return 'token'
+
+    content = bytes(range(256)) * 40
+    for honor_range, chunked in itertools.product((True, False), repeat=2):
+        client = Client(Files(content, honor_range, chunked))
+        with tempfile.TemporaryDirectory() as directory:
+            destination = os.path.join(directory, 'partial')
+            with open(destination, 'wb') as f:
+                f.write(content[:3000])
+            stream_download(client, 'url', destination, offset=3000, total=len(content), chunk_size=1000)
+            with open(destination, 'rb') as f:
+                assert f.read() == content, f"resumed download is wrong, range honored: {honor_range}, chunked: {chunked}"
+        offset, tail = 0, b''
+        for size in (4000, len(content)): # the output file as two successive looks see it
+            if size > offset:
+                for chunk in job_outputs.read_from(client, 'url', offset, size, chunk_size=1000):
+                    tail, offset = tail + chunk, offset + len(chunk)
+        assert tail == content, f"tail is wrong, range honored: {honor_range}, chunked: {chunked}"
+    print("range convention ok")